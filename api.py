@@ -0,0 +1,151 @@
+"""Логика JSON API поверх RehabilitationSystem.
+
+Функции принимают систему текущей версии онтологии и возвращают обычные
+словари: их сериализуют JSON-маршруты /api/*, а HTML-страницы передают те же
+данные в шаблоны.
+"""
+
+from catalog import FACET_ATTRIBUTES
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+PATIENT_REQUIRED_FIELDS = ['diagnosis', 'severity', 'age_group', 'movement_impairment', 'target']
+PATIENT_OPTIONAL_FIELDS = ['mobility_restrictions', 'pain_level']
+
+
+def patient_from_payload(payload):
+    """Собрать patient_data из JSON-объекта (как в форме /find-program)"""
+    if not isinstance(payload, dict):
+        raise ValueError('ожидается JSON-объект с данными пациента')
+
+    for key in ('patient_data', 'form', 'body'):
+        if isinstance(payload.get(key), dict):
+            payload = payload[key]
+            break
+
+    patient_data = {}
+    for field in PATIENT_REQUIRED_FIELDS:
+        if field not in payload:
+            raise ValueError(f'Не заполнено обязательное поле: {field!r}')
+        patient_data[field] = str(payload[field])
+
+    goals = payload.get('goals')
+    if goals is None:
+        goals = []
+    elif isinstance(goals, str):
+        goals = [goals]
+    if not isinstance(goals, list) or not all(isinstance(goal, str) for goal in goals):
+        raise ValueError(f"Поле 'goals': ожидается список строк, получено {goals!r}")
+    patient_data['goals'] = goals
+
+    for field in PATIENT_OPTIONAL_FIELDS:
+        if payload.get(field):
+            patient_data[field] = str(payload[field])
+
+    return patient_data
+
+
+def filters_from_args(args):
+    """Фильтры списка программ из параметров запроса (?method=...&target=...)"""
+    filters = {}
+    for facet in FACET_ATTRIBUTES:
+        values = [value for value in args.getlist(facet) if value]
+        if values:
+            filters[facet] = values
+    return filters
+
+
+def page_from_args(args):
+    """Номер и размер страницы из параметров запроса (?page=2&per_page=50)"""
+    page = args.get('page', 1, type=int) or 1
+    per_page = args.get('per_page', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE
+    return max(page, 1), min(max(per_page, 1), MAX_PAGE_SIZE)
+
+
+def list_programs(system, filters=None, page=1, per_page=DEFAULT_PAGE_SIZE):
+    """Страница программ каталога под фильтры и счетчики по фасетам.
+
+    Отбор идет по индексам фасетов, а записи программ сериализуются только для
+    выбранной страницы.
+    """
+    catalog = system.catalog
+    filters = filters or {}
+    program_ids = catalog.filter_program_ids(filters)
+    total = len(catalog) if program_ids is None else len(program_ids)
+    pages = max(1, -(-total // per_page))
+    page = min(page, pages)
+
+    start = (page - 1) * per_page
+    if program_ids is None:
+        page_ids = range(start, min(start + per_page, total))
+    else:
+        page_ids = program_ids[start:start + per_page]
+
+    counts = catalog.facet_counts(program_ids)
+    facets = {}
+    for facet in FACET_ATTRIBUTES:
+        values = counts[facet]
+        for value in filters.get(facet, ()):
+            values.setdefault(value, 0)
+        facets[facet] = [{'value': value, 'count': values[value]} for value in sorted(values)]
+
+    return {
+        'ontology_version': system.version,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': pages,
+        'filters': filters,
+        'facets': facets,
+        'programs': [catalog.programs[program_id].to_dict() for program_id in page_ids],
+    }
+
+
+def program_details(system, program_name):
+    """Детальное описание программы или None"""
+    return system.get_program_details(program_name)
+
+
+def match(system, patient_data, limit=None, explain=False):
+    """Подбор программ для пациента вместе с отображаемыми значениями анкеты"""
+    programs = system.find_optimal_programs(patient_data, limit, explain)
+
+    patient = dict(patient_data)
+    patient['target_display'] = system.target_translation.get(patient['target'], patient['target'])
+    patient['movement_display'] = system.movement_impairment_mapping.get(
+        patient['movement_impairment'], patient['movement_impairment']
+    )
+
+    return {
+        'ontology_version': system.version,
+        'patient_data': patient,
+        'translated_goals': system.translate_goals(patient['goals']),
+        'programs': programs,
+    }
+
+
+def similar(system, patient_data, k=None):
+    """Ближайшие к анкете пациенты онтологии и программы, в которых они указаны.
+
+    Программа попадает в список один раз — с близостью самого похожего
+    пациента, у которого она есть; список упорядочен по этой близости.
+    """
+    archetypes = system.find_similar_patients(patient_data, k)
+    programs = {}
+    for archetype in archetypes:
+        program_ids = archetype.pop('program_ids')
+        archetype['programs'] = [system.catalog.programs[program_id].name for program_id in program_ids]
+        for program_id in program_ids:
+            if program_id not in programs:
+                program = system.catalog.programs[program_id].to_dict()
+                program['similarity'] = archetype['similarity']
+                program['archetype'] = archetype['name']
+                programs[program_id] = program
+
+    return {
+        'ontology_version': system.version,
+        'patient_data': patient_data,
+        'archetypes': archetypes,
+        'programs': list(programs.values()),
+    }
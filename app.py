@@ -1,27 +1,59 @@
-from flask import Flask, render_template, request, jsonify, flash
-from owlready2 import *
+import time
+
+# Отсчет времени запуска: от начала импорта приложения до готовности
+STARTUP_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, flash, Response, stream_with_context, abort, g, session, has_app_context
 import os
+import copy
+import hmac
+import json
+import logging
+import threading
 
-app = Flask(__name__)
-app.secret_key = 'rehab_secret_key_2024'
+import api
+from cache import ResultCache, CachedPage, profile_key
+from catalog import compile_catalog
+from metrics import registry, stage, REQUEST_SECONDS, REQUESTS_TOTAL, RENDER_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ontology_store import OntologyManager, OntologyEditError, ONTOLOGY_PATH
+from scoring import ScoringEngine, top_k, MAX_SCORE, PATIENT_MATCH_BONUS, PATIENT_MOVEMENT_BONUS, PATIENT_TARGET_BONUS
+from similarity import ArchetypeIndex
+from tenants import ClinicUnavailable, TenantRegistry, UnknownClinic
 
-def load_ontology():
-    try:
-        onto_path.append("ontology")
-        onto = get_ontology("rehabilitation.owx").load()
-        print("✅ Онтология загружена успешно!")
-        return onto
+logging.basicConfig(
+    level=os.environ.get('REHAB_LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger('rehab')
 
-    except Exception as e:
-        print(f"❌ Ошибка загрузки онтологии: {e}")
-        return None
+app = Flask(__name__)
+app.secret_key = 'rehab_secret_key_2024'
+app.json.ensure_ascii = False
 
-onto = load_ontology()
+RESULT_CACHE_SIZE = int(os.environ.get('REHAB_CACHE_SIZE', 1024))
+RESULT_CACHE_TTL = float(os.environ.get('REHAB_CACHE_TTL', 300))
+TOP_K = int(os.environ.get('REHAB_TOP_K', 5))
+PAGE_CACHE_SIZE = int(os.environ.get('REHAB_PAGE_CACHE_SIZE', 256))
+PAGE_MAX_AGE = int(os.environ.get('REHAB_PAGE_MAX_AGE', 60))
+RETRIEVAL_BACKEND = os.environ.get('REHAB_RETRIEVAL_BACKEND', 'python')
+ONTOLOGY_WATCH = os.environ.get('REHAB_ONTOLOGY_WATCH', '') == '1'
+ONTOLOGY_WATCH_INTERVAL = float(os.environ.get('REHAB_ONTOLOGY_WATCH_INTERVAL', 2))
+ONTOLOGY_STORE = os.environ.get('REHAB_ONTOLOGY_STORE', '')
+ADMIN_TOKEN = os.environ.get('REHAB_ADMIN_TOKEN', '')
+TENANTS_DIR = os.environ.get('REHAB_TENANTS_DIR', os.path.join('ontology', 'clinics'))
+TENANT_MEMORY_MB = float(os.environ.get('REHAB_TENANT_MEMORY_MB', 512))
+TENANT_IDLE_TTL = float(os.environ.get('REHAB_TENANT_IDLE_TTL', 1800))
+TENANT_MAX_LOADED = int(os.environ.get('REHAB_TENANT_MAX_LOADED', 0))
+WARMUP_RETRY_INTERVAL = float(os.environ.get('REHAB_WARMUP_RETRY_INTERVAL', 5))
 
 class RehabilitationSystem:
-    def __init__(self, ontology):
+    def __init__(self, ontology, cache_size=RESULT_CACHE_SIZE, cache_ttl=RESULT_CACHE_TTL, top_k=TOP_K,
+                 page_cache_size=PAGE_CACHE_SIZE, backend=RETRIEVAL_BACKEND):
         self.onto = ontology
-        print("Система реабилитации инициализирована")
+        self.version = None
+        self.top_k = top_k
+        self.backend = backend
+        logger.info("Система реабилитации инициализирована")
         
         self.condition_mapping = {
             'инсульт': ['patient_stroke_mild', 'patient_stroke_severe', 'Пациент_Инсульт_Легкий', 'Пациент_Инсульт_Тяжелый'],
@@ -69,373 +101,209 @@ class RehabilitationSystem:
             'method_massage': 'Массаж'
         }
 
+        with stage('catalog_build'):
+            self.catalog = compile_catalog(ontology, self.condition_mapping, backend)
+            self.scoring = ScoringEngine(self.catalog.programs, self.target_translation)
+            self.archetypes = self._archetype_index(self.catalog)
+        # Кэш принадлежит экземпляру: при загрузке новой онтологии создается
+        # новая система, и старые результаты становятся недоступны
+        self.cache = ResultCache(cache_size, cache_ttl)
+        # Отрендеренные страницы только для чтения: живут, пока жива версия онтологии
+        self.page_cache = ResultCache(page_cache_size, ttl=0)
+
+    def updated(self, programs=(), removed_programs=(), patients=(), removed_patients=()):
+        """Новая система после правки онтологии (аргументы — как у ProgramCatalog.updated).
+
+        Каталог, матрица признаков и индекс похожих пациентов обновляются
+        только для затронутых записей.
+        Из кэша результатов убираются профили затронутых диагнозов, из кэша
+        страниц — список программ и страницы измененных программ; остальные
+        записи переносятся в новую систему.
+        """
+        system = copy.copy(self)
+        with stage('catalog_update'):
+            catalog, changed_ids, removed_ids, affected_diagnoses = self.catalog.updated(
+                programs, removed_programs, patients, removed_patients
+            )
+            system.catalog = catalog
+            system.scoring = self.scoring.updated(catalog.programs, changed_ids, removed_ids)
+            system.archetypes = self.archetypes.updated(
+                catalog.patients, catalog.programs, [patient.name for patient in patients], changed_ids, removed_ids
+            )
+
+        # Первый элемент ключа результата — диагноз в нижнем регистре (см. profile_key)
+        system.cache = self.cache.copy(lambda key: key[0] not in affected_diagnoses)
+        stale_pages = {f'/program/{program.name}' for program in programs}
+        stale_pages.update(f'/program/{name}' for name in removed_programs)
+        system.page_cache = self.page_cache.copy(
+            lambda path: path.startswith('/program/') and path.split('?', 1)[0] not in stale_pages
+        )
+        return system
+
+    def _archetype_index(self, catalog):
+        return ArchetypeIndex(catalog.patients, catalog.programs, self.condition_mapping,
+                              self.target_translation, self.goal_translation)
+
     def get_all_programs(self):
         """Получить все программы реабилитации"""
+        return [program.to_dict() for program in self.catalog.programs]
+
+    def find_optimal_programs(self, patient_data, limit=None, explain=False):
+        """Подбор оптимальных программ реабилитации с учетом новых свойств.
+
+        explain=True добавляет к каждой программе разбор балла (ключ 'explanation');
+        разбор строится только для возвращаемых программ и не кэшируется.
+        """
         if not self.onto:
+            logger.warning("Онтология не загружена")
             return []
+        if limit is None:
+            limit = self.top_k
             
-        programs = []
         try:
-            program_class = None
-            for cls in self.onto.classes():
-                if 'Программа' in str(cls) or 'Program' in str(cls):
-                    program_class = cls
-                    break
+            programs = self.cache.get_or_compute(
+                profile_key(patient_data) + (limit,),
+                lambda: self._find_optimal_programs(patient_data, limit)
+            )
+            result = [dict(program) for program in programs]
+            if explain:
+                for program in result:
+                    program['explanation'] = self.explain_score(patient_data, program['name'])
+            return result
             
-            if program_class:
-                all_instances = list(program_class.instances())
+        except Exception:
+            logger.exception("Ошибка в find_optimal_programs")
+            return []
+
+    def _find_optimal_programs(self, patient_data, limit):
+        """Подбор программ без обращения к кэшу"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "match diagnosis=%s severity=%s movement=%s target=%s goals=%s patients=%s",
+                patient_data['diagnosis'], patient_data.get('severity', ''),
+                patient_data.get('movement_impairment', ''), patient_data.get('target', ''),
+                patient_data.get('goals', []),
+                sorted(self.catalog.diagnosis_patients.get(patient_data['diagnosis'].lower(), ()))
+            )
+        
+        return self._rank_programs(patient_data, limit=limit)
+
+    def find_optimal_programs_batch(self, patients, chunk_size=256, limit=None):
+        """Подбор программ для группы пациентов: по одному результату на пациента"""
+        if limit is None:
+            limit = self.top_k
+        for start in range(0, len(patients), chunk_size):
+            chunk = patients[start:start + chunk_size]
+            if self.onto:
+                with stage('batch_scoring'):
+                    scores = self.scoring.score_batch(chunk)
             else:
-                all_instances = []
-                for cls in self.onto.classes():
-                    for inst in cls.instances():
-                        if 'program' in str(inst).lower() or 'программа' in str(inst).lower():
-                            all_instances.append(inst)
-            
-            print(f"Найдено {len(all_instances)} программ")
-            
-            for program in all_instances:
-                try:
-                    program_info = {
-                        'name': program.name,
-                        'display_name': self._get_display_name(program),
-                        'duration': self._get_property(program, 'hasDuration', 'имеетДлительность'),
-                        'session_count': self._get_property(program, 'hasSessionCount', 'имеетКоличествоСеансов'),
-                        'methods': self._get_related(program, 'includesMethod', 'включаетМетод'),
-                        'specialists': self._get_related(program, 'supervisedBy', 'курируется'),
-                        'suitable_patients': self._get_related(program, 'suitableFor', 'подходитДля'),
-                        'target': self._get_related(program, 'hasTarget', 'имеетЦелевуюГруппу'),
-                        'movement_impairemet': self._get_property(program, 'suitableMovementImpairment', 'подходитДляУровняДвижения')
-                    }
-                    programs.append(program_info)
-                except Exception as e:
-                    print(f"Ошибка при обработке программы {program}: {e}")
+                scores = None
+            for i, patient_data in enumerate(chunk):
+                if scores is None:
+                    yield []
                     continue
-                    
-        except Exception as e:
-            print(f"Ошибка в get_all_programs: {e}")
-            import traceback
-            traceback.print_exc()
-            
-        return programs
+                yield self._rank_programs(patient_data, scores[:, i], limit)
 
-    def _get_display_name(self, entity):
-        """Получить отображаемое имя"""
-        try:
-            if hasattr(entity, 'comment') and entity.comment:
-                comment = entity.comment[0] if isinstance(entity.comment, list) else entity.comment
-                if comment and str(comment).strip():
-                    return str(comment)
-            
-            if hasattr(entity, 'label') and entity.label:
-                label = entity.label[0] if isinstance(entity.label, list) else entity.label
-                if label and str(label).strip():
-                    return str(label)
-            
-            name = entity.name
-            name = name.replace('_', ' ')
-            name = name.replace('program', '')
-            name = name.replace('Program', '')
-            name = name.replace('программа', '')
-            name = name.replace('Программа', '')
-            return name.strip().title()
-            
-        except:
-            return entity.name if hasattr(entity, 'name') else str(entity)
-
-    def _get_property(self, entity, *property_names):
-        """Получить значение свойства"""
-        for prop_name in property_names:
-            if hasattr(entity, prop_name):
-                value = getattr(entity, prop_name)
-                if value:
-                    if isinstance(value, list):
-                        return value[0] if value else 'Не указано'
-                    return value
-        return 'Не указано'
-
-    def _get_related(self, entity, *property_names):
-        """Получить связанные сущности"""
-        result = []
-        for prop_name in property_names:
-            if hasattr(entity, prop_name):
-                related = getattr(entity, prop_name)
-                if related:
-                    if isinstance(related, list):
-                        for item in related:
-                            if item:
-                                display_name = self._get_display_name(item)
-                                result.append(display_name)
-                    else:
-                        if related:
-                            display_name = self._get_display_name(related)
-                            result.append(display_name)
-        return result
-
-    def find_optimal_programs(self, patient_data):
-        """Подбор оптимальных программ реабилитации с учетом новых свойств"""
-        if not self.onto:
-            print("Онтология не загружена")
+    def _rank_programs(self, patient_data, scores=None, limit=5):
+        """Отбор программ по диагнозу и ранжирование (баллы можно передать готовыми).
+
+        Соответствие конкретным пациентам онтологии проверяется только для тех
+        кандидатов, которые с максимальным бонусом еще могут попасть в первые
+        limit программ.
+        """
+        diagnosis = patient_data['diagnosis'].lower()
+        movement_impairment = patient_data.get('movement_impairment', '').lower()
+        target = patient_data.get('target', '')
+        
+        with stage('diagnosis_filter'):
+            candidate_ids = list(self.catalog.program_ids_for_diagnosis(diagnosis))
+        if not candidate_ids:
+            logger.debug("match diagnosis=%s candidates=0", diagnosis)
             return []
+        
+        with stage('scoring'):
+            if scores is None:
+                scores = self.scoring.score(patient_data)
+            scores = scores[candidate_ids]
             
-        try:
-            diagnosis = patient_data['diagnosis'].lower()
-            movement_impairment = patient_data.get('movement_impairment', '').lower()
-            target = patient_data.get('target', '')
-            
-            print(f"Данные пациента: диагноз={diagnosis}, нарушение движения={movement_impairment}, цель={target}")
-            
-            possible_patient_names = self.condition_mapping.get(diagnosis, [])
-            print(f"Возможные имена пациентов: {possible_patient_names}")
-            
-            all_programs = self.get_all_programs()
-            print(f"Всего программ в системе: {len(all_programs)}")
-            
+            ranked = top_k(scores, lambda position: self._check_patient_specific_match(
+                diagnosis, movement_impairment, target, candidate_ids[position]
+            ), limit)
+        
+        with stage('sort'):
             suitable_programs = []
-            
-            for program_info in all_programs:
-                program_name = program_info['name']
-                print(f"\nАнализируем программу: {program_name}")
-                
-                program = self.onto.search_one(iri=f"*#{program_name}")
-                if not program:
-                    print(f"  Программа {program_name} не найдена в онтологии")
-                    continue
-                
-                program_patients = self._get_related(program, 'suitableFor', 'подходитДля')
-                print(f"  Пациенты программы: {program_patients}")
-                
-                matches_diagnosis = False
-                for patient_display_name in program_patients:
-                    for patient in self.onto.individuals():
-                        if hasattr(patient, 'name'):
-                            patient_display = self._get_display_name(patient)
-                            if patient_display == patient_display_name:
-                                for possible_name in possible_patient_names:
-                                    if possible_name in patient.name or possible_name in patient_display:
-                                        matches_diagnosis = True
-                                        print(f"  ✓ Совпадение по диагнозу: {patient.name}")
-                                        break
-                
-                if not matches_diagnosis:
-                    print(f"  ✗ Не подходит по диагнозу")
-                    continue
-                
-                base_score = 50
-                
-                goals = patient_data.get('goals', [])
-                program_methods = program_info['methods']
-                
-                for goal in goals:
-                    if self._goal_matches_methods(goal, program_methods):
-                        base_score += 10
-                        print(f"  +10 баллов: цель '{goal}' совпадает с методами программы")
-                
-                severity = patient_data.get('severity', '')
-                if severity == 'тяжелая' and any('робот' in method.lower() for method in program_methods):
-                    base_score += 15
-                    print(f"  +15 баллов: тяжелое состояние + роботизированная терапия")
-                elif severity == 'легкая' and any('лфк' in method.lower() for method in program_methods):
-                    base_score += 10
-                    print(f"  +10 баллов: легкое состояние + ЛФК")
-                
-                if movement_impairment:
-                    movement_match_score = self._check_movement_impairment_match(
-                        movement_impairment, 
-                        program_info.get('movement_impairment', ''),
-                        program_methods
-                    )
-                    base_score += movement_match_score
-                    if movement_match_score > 0:
-                        print(f"  +{movement_match_score} баллов: совпадение по уровню движения")
-                
-                if target:
-                    target_match_score = self._check_target_match(
-                        target,
-                        program_info.get('target', []),
-                        program_methods
-                    )
-                    base_score += target_match_score
-                    if target_match_score > 0:
-                        print(f"  +{target_match_score} баллов: совпадение по цели реабилитации")
-                
-                patient_specific_score = self._check_patient_specific_match(
-                    diagnosis, movement_impairment, target, program
-                )
-                base_score += patient_specific_score
-                if patient_specific_score > 0:
-                    print(f"  +{patient_specific_score} баллов: специфическое соответствие пациенту")
-                
-                score = min(base_score, 100)
-                
+            for position, score in ranked:
+                program = self.catalog.programs[candidate_ids[position]]
+                program_info = program.to_dict()
                 program_info['score'] = score
-                program_info['matching_patients'] = program_patients
+                program_info['matching_patients'] = program_info['suitable_patients']
                 program_info['movement_match'] = movement_impairment if movement_impairment else 'Не указано'
                 program_info['target_match'] = self.target_translation.get(target, target) if target else 'Не указано'
-                
                 suitable_programs.append(program_info)
-                print(f"  Итоговый балл: {score}")
-            
-            suitable_programs.sort(key=lambda x: x.get('score', 0), reverse=True)
-            print(f"\nВсего найдено подходящих программ: {len(suitable_programs)}")
-            
-            return suitable_programs[:5]
-            
-        except Exception as e:
-            print(f"Ошибка в find_optimal_programs: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
-
-    def _check_movement_impairment_match(self, patient_impairment, program_movement_impairment, program_methods):
-        """Проверка соответствия уровня нарушения движения"""
-        score = 0
         
-        impairment_method_map = {
-            'severe': ['роботизированная терапия', 'гидротерапия', 'массаж'],
-            'paralysis': ['роботизированная терапия', 'электрофорез', 'магнитотерапия'],
-            'moderate': ['лфк', 'эрготерапия', 'массаж'],
-            'mild': ['лфк', 'физиотерапия', 'упражнения'],
-            'none': ['упражнения', 'профилактика']
-        }
-        
-        if program_movement_impairment:
-            program_level_lower = program_movement_impairment.lower()
-            patient_level_lower = patient_impairment.lower()
-            
-            level_compatibility = {
-                'severe': ['severe', 'paralysis', 'moderate'],
-                'moderate': ['moderate', 'mild', 'severe'],
-                'mild': ['mild', 'none', 'moderate'],
-                'none': ['none', 'mild']
-            }
-            
-            if patient_level_lower in level_compatibility.get(program_level_lower, []):
-                score += 10
-        
-        suitable_methods = impairment_method_map.get(patient_impairment, [])
-        program_methods_lower = [m.lower() for m in program_methods]
-        
-        for method in suitable_methods:
-            if any(method in pm for pm in program_methods_lower):
-                score += 5
-                break
-        
-        return score
+        logger.debug("match diagnosis=%s candidates=%d returned=%d", diagnosis, len(candidate_ids), len(suitable_programs))
+        return suitable_programs
 
-    def _check_target_match(self, patient_target, program_target, program_methods):
-        """Проверка соответствия цели реабилитации"""
-        score = 0
-        
-        target_method_map = {
-            'walking': ['роботизированная терапия', 'лфк', 'ходьба'],
-            'balance': ['упражнения на баланс', 'лфк', 'физиотерапия'],
-            'strength': ['силовые упражнения', 'лфк', 'тренажеры'],
-            'flexibility': ['растяжка', 'йога', 'пилатес'],
-            'coordination': ['эрготерапия', 'упражнения на координацию', 'лфк'],
-            'pain_reduction': ['массаж', 'физиотерапия', 'гидротерапия']
-        }
-        
-        if program_target:
-            program_targets_lower = [t.lower() for t in program_target]
-            patient_target_lower = patient_target.lower()
-            patient_target_translated = self.target_translation.get(patient_target, patient_target).lower()
-            
-            for program_target in program_targets_lower:
-                if (patient_target_lower in program_target or 
-                    patient_target_translated in program_target or
-                    any(word in program_target for word in patient_target_lower.split('_'))):
-                    score += 10
-                    break
-        
-        suitable_methods = target_method_map.get(patient_target, [])
-        program_methods_lower = [m.lower() for m in program_methods]
-        
-        for method in suitable_methods:
-            if any(method in pm for pm in program_methods_lower):
-                score += 5
-                break
+    def _check_patient_specific_match(self, diagnosis, movement_impairment, target, program_id):
+        """Проверка специфического соответствия конкретному пациенту в онтологии"""
+        patient = self.catalog.matching_patient(diagnosis, program_id)
+        if patient is None:
+            return 0
         
+        score = PATIENT_MATCH_BONUS
+        if movement_impairment and patient.movement and movement_impairment in patient.movement:
+            score += PATIENT_MOVEMENT_BONUS
+        if target and patient.target and target in patient.target:
+            score += PATIENT_TARGET_BONUS
         return score
 
-    def _check_patient_specific_match(self, diagnosis, movement_impairment, target, program):
-        """Проверка специфического соответствия конкретному пациенту в онтологии"""
-        score = 0
+    def explain_score(self, patient_data, program_name):
+        """Разбор балла программы для пациента по составляющим"""
+        program_id = self.catalog.ids_by_name[program_name]
+        program = self.catalog.programs[program_id]
+        diagnosis = patient_data['diagnosis'].lower()
+        movement_impairment = patient_data.get('movement_impairment', '').lower()
+        target = patient_data.get('target', '')
         
-        try:
-            all_patients = []
-            for cls in self.onto.classes():
-                if 'Пациент' in str(cls) or 'Patient' in str(cls):
-                    all_patients.extend(cls.instances())
-            
-            for patient in all_patients:
-                patient_diagnosis_matches = False
-                for possible_name in self.condition_mapping.get(diagnosis, []):
-                    if possible_name in patient.name:
-                        patient_diagnosis_matches = True
-                        break
-                
-                if not patient_diagnosis_matches:
-                    continue
-                
-                patient_movement = ''
-                if hasattr(patient, 'hasMovementImpairment'):
-                    movement_value = getattr(patient, 'hasMovementImpairment')
-                    if movement_value:
-                        if isinstance(movement_value, list):
-                            patient_movement = str(movement_value[0]).lower()
-                        else:
-                            patient_movement = str(movement_value).lower()
-                
-                patient_target = ''
-                if hasattr(patient, 'hasTarget'):
-                    target_value = getattr(patient, 'hasTarget')
-                    if target_value:
-                        if isinstance(target_value, list):
-                            patient_target = str(target_value[0]).lower()
-                        else:
-                            patient_target = str(target_value).lower()
-                
-                if hasattr(program, 'suitableFor') or hasattr(program, 'подходитДля'):
-                    suitable_for = getattr(program, 'suitableFor', []) or getattr(program, 'подходитДля', [])
-                    if not isinstance(suitable_for, list):
-                        suitable_for = [suitable_for]
-                    
-                    for suitable_patient in suitable_for:
-                        if patient.name == suitable_patient.name:
-                            score += 5
-                            
-                            if movement_impairment and patient_movement and movement_impairment in patient_movement:
-                                score += 5
-                            
-                            if target and patient_target and target in patient_target:
-                                score += 5
-                            
-                            return score
+        explanation = self.scoring.explain(patient_data, program_id)
+        diagnosis_patients = self.catalog.diagnosis_patients.get(diagnosis, frozenset())
+        explanation['diagnosis_patients'] = sorted(program.suitable_patient_names & diagnosis_patients)
         
-        except Exception as e:
-            print(f"Ошибка в проверке специфического соответствия: {e}")
+        patient = self.catalog.matching_patient(diagnosis, program_id)
+        patient_specific = {'patient': None, 'match': 0, 'movement': 0, 'target': 0}
+        if patient is not None:
+            patient_specific['patient'] = patient.name
+            patient_specific['match'] = PATIENT_MATCH_BONUS
+            if movement_impairment and patient.movement and movement_impairment in patient.movement:
+                patient_specific['movement'] = PATIENT_MOVEMENT_BONUS
+            if target and patient.target and target in patient.target:
+                patient_specific['target'] = PATIENT_TARGET_BONUS
+        explanation['patient_specific'] = patient_specific
         
-        return score
+        total = (explanation['base'] + sum(explanation['goals'].values()) + explanation['severity']
+                 + explanation['movement_method']
+                 + explanation['target'] + explanation['target_method']
+                 + patient_specific['match'] + patient_specific['movement'] + patient_specific['target'])
+        explanation['total'] = total
+        explanation['score'] = min(total, MAX_SCORE)
+        return explanation
 
-    def _goal_matches_methods(self, goal, methods):
-        """Проверка соответствия целей методам"""
-        method_strings = [str(m).lower() for m in methods]
-        
-        goal_method_map = {
-            'walking': ['лфк', 'exercise', 'механотерапия', 'робот', 'ходьба'],
-            'mobility': ['физиотерапия', 'physiotherapy', 'электро', 'магнит', 'подвижность'],
-            'pain_relief': ['физиотерапия', 'массаж', 'massage', 'обезболивание'],
-            'coordination': ['лфк', 'эрготерапия', 'occupational', 'координация'],
-            'psychological': ['психологическая', 'психология', 'psychological', 'кпт', 'психотерапия'],
-            'daily_activities': ['эрготерапия', 'occupational', 'бытовые', 'повседневные']
-        }
-        
-        required_methods = goal_method_map.get(goal, [])
-        for required in required_methods:
-            for method in method_strings:
-                if required in method:
-                    return True
-        return False
+    def find_similar_patients(self, patient_data, k=None):
+        """Пациенты онтологии (архетипы), ближайшие к анкете по профилю, с их программами.
+
+        В отличие от find_optimal_programs не требует, чтобы диагноз совпадал с
+        именами пациентов из condition_mapping: близость считается по всем полям анкеты.
+        """
+        with stage('similarity'):
+            nearest = self.archetypes.nearest(patient_data, k or self.top_k)
+        archetypes = []
+        for row, similarity in nearest:
+            archetype = self.archetypes.patients[row].to_dict()
+            archetype['similarity'] = similarity
+            archetype['program_ids'] = self.archetypes.programs_by_patient[row]
+            archetypes.append(archetype)
+        return archetypes
 
     def translate_goals(self, goals):
         """Перевод целей на русский"""
@@ -443,54 +311,220 @@ class RehabilitationSystem:
 
     def get_program_details(self, program_name):
         """Получить детальную информацию о программе"""
-        if not self.onto:
-            return None
-            
-        try:
-            program = self.onto.search_one(iri=f"*#{program_name}")
-            if not program:
-                return None
-            
-            methods_with_effectiveness = []
-            if hasattr(program, 'includesMethod') or hasattr(program, 'включаетМетод'):
-                methods = getattr(program, 'includesMethod', []) or getattr(program, 'включаетМетод', [])
-                if not isinstance(methods, list):
-                    methods = [methods]
-                    
-                for method in methods:
-                    if method:
-                        effectiveness = 'Не указано'
-                        if hasattr(method, 'hasEffectivenessScore'):
-                            eff_value = method.hasEffectivenessScore
-                            if eff_value:
-                                effectiveness = eff_value[0] if isinstance(eff_value, list) else eff_value
-                        elif hasattr(method, 'имеетЭффективность'):
-                            eff_value = method.имеетЭффективность
-                            if eff_value:
-                                effectiveness = eff_value[0] if isinstance(eff_value, list) else eff_value
-                        
-                        methods_with_effectiveness.append({
-                            'name': self._get_display_name(method),
-                            'effectiveness': effectiveness
-                        })
-            
-            return {
-                'name': program.name,
-                'display_name': self._get_display_name(program),
-                'duration': self._get_property(program, 'hasDuration', 'имеетДлительность'),
-                'session_count': self._get_property(program, 'hasSessionCount', 'имеетКоличествоСеансов'),
-                'methods': methods_with_effectiveness,
-                'specialists': self._get_related(program, 'supervisedBy', 'курируется'),
-                'suitable_patients': self._get_related(program, 'suitableFor', 'подходитДля'),
-                'target': self._get_related(program, 'hasTarget', 'имеетЦель'),
-                'movement_impairment': self._get_property(program, 'suitableMovementImpairment', 'подходитДляУровняДвижения')
-            }
-            
-        except Exception as e:
-            print(f"Ошибка в get_program_details: {e}")
+        program = self.catalog.get(program_name)
+        if not program:
             return None
+        return program.to_details()
+
+# Онтология загружается в фоне (см. warm_up): сервер начинает принимать
+# соединения сразу, а до готовности отвечает 503 на запросы, которым нужен каталог
+ontology_manager = OntologyManager(ONTOLOGY_PATH, RehabilitationSystem, ONTOLOGY_STORE or None)
+startup = {'import_seconds': None, 'warmup_seconds': None, 'ready_seconds': None, 'attempts': 0}
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+def warm_up(max_attempts=None, watch=True):
+    """Загрузить и скомпилировать основную онтологию.
+
+    При ошибке загрузка повторяется через WARMUP_RETRY_INTERVAL, но не больше
+    max_attempts раз (None — пока не получится). С watch=False наблюдение за
+    файлом не запускается (главный процесс gunicorn: поток наблюдения мог бы
+    держать _reload_lock в момент fork). Возвращает True, если система готова.
+    """
+    attempts = 0
+    while ontology_manager.current is None:
+        if max_attempts is not None and attempts >= max_attempts:
+            return False
+        if attempts:
+            time.sleep(WARMUP_RETRY_INTERVAL)
+        attempts += 1
+        startup['attempts'] += 1
+        started = time.perf_counter()
+        if ontology_manager.load_if_missing() is None:
+            logger.error("Онтология не загружена (попытка %d): %s", startup['attempts'], ontology_manager.last_error)
+            continue
+        if startup['ready_seconds'] is not None:
+            # Онтологию загрузил одновременный вызов
+            break
+        startup['warmup_seconds'] = time.perf_counter() - started
+        startup['ready_seconds'] = time.perf_counter() - STARTUP_STARTED
+        logger.info("Готово к работе: онтология %s загружена и скомпилирована за %.2f с, с начала запуска %.2f с",
+                    ontology_manager.current.version, startup['warmup_seconds'], startup['ready_seconds'])
+    if watch and ONTOLOGY_WATCH:
+        ontology_manager.watch(ONTOLOGY_WATCH_INTERVAL)
+    return True
+
+def start_warmup():
+    """Запустить warm_up в фоновом потоке, если онтология еще не загружена и
+    загрузка не идет (после fork поток родителя не существует и запускается заново)"""
+    global _warmup_thread
+    with _warmup_lock:
+        if ontology_manager.current is None and not (_warmup_thread and _warmup_thread.is_alive()):
+            _warmup_thread = threading.Thread(target=warm_up, name='ontology-warmup', daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+tenant_registry = TenantRegistry(
+    TENANTS_DIR, RehabilitationSystem, int(TENANT_MEMORY_MB * 2 ** 20), TENANT_IDLE_TTL,
+    ONTOLOGY_WATCH_INTERVAL if ONTOLOGY_WATCH else None, TENANT_MAX_LOADED
+)
+
+def get_ontology_manager():
+    """Менеджер онтологии клиники из адреса запроса (/t/<клиника>/...) или основной"""
+    manager = g.get('ontology_manager') if has_app_context() else None
+    return manager or ontology_manager
+
+def get_rehab_system():
+    """Система текущей версии онтологии (запрос берет ее один раз и работает с ней до конца)"""
+    return get_ontology_manager().current.system
+
+def _require_admin():
+    # Без настроенного токена административные запросы запрещены
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        abort(403)
+
+@app.url_value_preprocessor
+def pop_clinic(endpoint, values):
+    g.clinic = values.pop('clinic', None) if values else None
 
-rehab_system = RehabilitationSystem(onto)
+@app.url_defaults
+def add_clinic(endpoint, values):
+    # Ссылки на страницах клиники ведут на адреса той же клиники
+    if g.get('clinic') and app.url_map.is_endpoint_expecting(endpoint, 'clinic'):
+        values.setdefault('clinic', g.clinic)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Отвечают и до загрузки основной онтологии
+NO_ONTOLOGY_ENDPOINTS = frozenset({'static', 'healthz', 'readyz', 'metrics', 'index', 'patient_form'})
+
+def _unavailable(detail, error='Онтология загружается, повторите запрос позже'):
+    response = jsonify(error=error, detail=detail)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(WARMUP_RETRY_INTERVAL)))
+    return response
+
+@app.before_request
+def require_ontology():
+    if ontology_manager.current is not None:
+        return None
+    # Под серверами без хука запуска загрузка начинается с первого запроса
+    start_warmup()
+    if request.endpoint in NO_ONTOLOGY_ENDPOINTS or g.get('clinic'):
+        return None
+    return _unavailable(ontology_manager.last_error)
+
+@app.before_request
+def load_clinic():
+    if g.get('clinic') is None:
+        return
+    try:
+        # Менеджер хранится в g: вытеснение клиники не мешает доработать запросу
+        g.ontology_manager = tenant_registry.get(g.clinic)
+    except UnknownClinic:
+        abort(404)
+    except ClinicUnavailable as e:
+        return _unavailable(e.error, 'Онтология клиники не загрузилась, повторите запрос позже')
+
+@app.after_request
+def add_ontology_version(response):
+    snapshot = get_ontology_manager().current
+    if snapshot is not None:
+        response.headers['X-Ontology-Version'] = snapshot.version
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if endpoint != 'static' and 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint)
+        REQUESTS_TOTAL.inc(endpoint, str(response.status_code))
+    return response
+
+def _render(template_name, **context):
+    """render_template с замером времени рендеринга"""
+    with RENDER_SECONDS.time(template_name):
+        return render_template(template_name, **context)
+
+def _cached_page(system, render):
+    """Ответ со страницей из кэша системы (рендеринг и сжатие — один раз на версию).
+
+    Поддерживает условные запросы (If-None-Match -> 304) и отдает сжатое тело
+    клиентам, принимающим gzip. Страницы с ожидающими flash-сообщениями не
+    кэшируются: они зависят от сессии.
+    """
+    if '_flashes' in session:
+        return render()
+    
+    # Кэш страниц принадлежит системе клиники, поэтому ключ — путь без префикса
+    # клиники (его же ожидает RehabilitationSystem.updated)
+    path = request.full_path
+    if g.get('clinic'):
+        path = path[len(f'/t/{g.clinic}'):]
+    page = system.page_cache.get_or_compute(path, lambda: CachedPage(render(), system.version))
+    
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = page.etag + '-gz' if use_gzip else page.etag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(page.gzipped if use_gzip else page.body, mimetype=page.mimetype)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = PAGE_MAX_AGE
+    return response
+
+def _collect_system_metrics():
+    snapshot = ontology_manager.current
+    lines = [
+        '# HELP rehab_ready Основная онтология загружена и скомпилирована',
+        '# TYPE rehab_ready gauge',
+        f'rehab_ready {int(snapshot is not None)}',
+    ]
+    if startup['ready_seconds'] is not None:
+        lines += [
+            '# HELP rehab_startup_seconds Время от начала импорта приложения до готовности',
+            '# TYPE rehab_startup_seconds gauge',
+            f'rehab_startup_seconds {startup["ready_seconds"]}',
+        ]
+    if snapshot is None:
+        return lines
+    lines += [
+        '# HELP rehab_ontology_info Загруженная версия онтологии',
+        '# TYPE rehab_ontology_info gauge',
+        f'rehab_ontology_info{{version="{snapshot.version}"}} 1',
+        '# HELP rehab_catalog_programs Количество программ в каталоге',
+        '# TYPE rehab_catalog_programs gauge',
+        f'rehab_catalog_programs {len(snapshot.system.catalog)}',
+    ]
+    caches = (
+        ('result', 'Кэш результатов', snapshot.system.cache),
+        ('page', 'Кэш страниц', snapshot.system.page_cache),
+    )
+    for prefix, title, cache in caches:
+        stats = cache.stats()
+        lines += [
+            f'# HELP rehab_{prefix}_cache_size {title}: количество записей',
+            f'# TYPE rehab_{prefix}_cache_size gauge',
+            f'rehab_{prefix}_cache_size {stats["size"]}',
+        ]
+        for name in ('hits', 'misses', 'evictions', 'expirations', 'coalesced'):
+            lines += [
+                f'# HELP rehab_{prefix}_cache_{name}_total {title}: {name}',
+                f'# TYPE rehab_{prefix}_cache_{name}_total counter',
+                f'rehab_{prefix}_cache_{name}_total {stats[name]}',
+            ]
+    return lines
+
+registry.add_collector(_collect_system_metrics)
+registry.add_collector(tenant_registry.collect_metrics)
 
 @app.route('/')
 def index():
@@ -517,45 +551,256 @@ def find_program():
             if field in request.form and request.form[field]:
                 patient_data[field] = request.form[field]
         
-        print(f"Данные пациента: {patient_data}")
-        print(f"Обязательные поля - диагноз: {patient_data['diagnosis']}, цель: {patient_data['target']}, ограничение движения: {patient_data['movement_impairment']}")
-        
-        optimal_programs = rehab_system.find_optimal_programs(patient_data)
-        
-        translated_goals = rehab_system.translate_goals(patient_data['goals'])
+        logger.debug("find-program patient_data=%s", patient_data)
         
-        patient_data['target_display'] = rehab_system.target_translation.get(patient_data['target'], patient_data['target'])
-        patient_data['movement_display'] = rehab_system.movement_impairment_mapping.get(patient_data['movement_impairment'], patient_data['movement_impairment'])
-        
-        return render_template('results.html', 
-                             programs=optimal_programs,
-                             patient_data=patient_data,
-                             translated_goals=translated_goals)
+        explain = request.args.get('explain') == '1' or request.form.get('explain') == '1'
+        result = api.match(get_rehab_system(), patient_data, explain=explain)
+        return _render('results.html', 
+                       programs=result['programs'],
+                       patient_data=result['patient_data'],
+                       translated_goals=result['translated_goals'])
     
     except KeyError as e:
         flash(f'Не заполнено обязательное поле: {str(e)}', 'error')
         return render_template('patient_form.html')
     except Exception as e:
         flash(f'Ошибка при обработке запроса: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка при обработке /find-program")
         return render_template('patient_form.html')
 
+BATCH_CHUNK_SIZE = 256
+def _iter_batch_payloads(stream):
+    """Разобрать тело запроса: JSON-массив или NDJSON (по объекту на строку).
+
+    Возвращает пары (объект, ошибка разбора).
+    """
+    first_line = b''
+    for line in stream:
+        if line.strip():
+            first_line = line
+            break
+    
+    if first_line.lstrip().startswith(b'['):
+        for payload in json.loads(first_line + stream.read()):
+            yield payload, None
+        return
+    
+    def all_lines():
+        if first_line:
+            yield first_line
+        yield from stream
+    
+    for line in all_lines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f'Некорректная строка JSON: {e}'
+
+def _batch_result_line(index, payload, programs=None, error=None):
+    request_id = None
+    if isinstance(payload, dict):
+        request_id = payload.get('request_id', payload.get('id'))
+    
+    result = {'index': index, 'request_id': request_id}
+    if error is not None:
+        result['error'] = error
+    else:
+        result['programs'] = [
+            {'name': program['name'], 'display_name': program['display_name'], 'score': program['score']}
+            for program in programs
+        ]
+    return json.dumps(result, ensure_ascii=False, default=str) + '\n'
+
+@app.route('/api/find-programs/batch', methods=['POST'])
+def find_programs_batch():
+    """Пакетный подбор программ: JSON-массив или NDJSON на входе, NDJSON на выходе"""
+    system = get_rehab_system()
+    
+    def process(chunk):
+        patients = [patient_data for _, _, patient_data, error in chunk if error is None]
+        results = iter(system.find_optimal_programs_batch(patients, BATCH_CHUNK_SIZE))
+        for index, payload, patient_data, error in chunk:
+            if error is not None:
+                yield _batch_result_line(index, payload, error=error)
+            else:
+                yield _batch_result_line(index, payload, programs=next(results))
+    
+    def generate():
+        chunk = []
+        try:
+            for index, (payload, error) in enumerate(_iter_batch_payloads(request.stream)):
+                if error is not None:
+                    chunk.append((index, None, None, error))
+                else:
+                    try:
+                        chunk.append((index, payload, api.patient_from_payload(payload), None))
+                    except ValueError as e:
+                        chunk.append((index, payload, None, str(e)))
+                
+                if len(chunk) >= BATCH_CHUNK_SIZE:
+                    yield from process(chunk)
+                    chunk = []
+        except ValueError as e:
+            yield json.dumps({'error': f'Некорректный JSON: {e}'}, ensure_ascii=False) + '\n'
+        
+        yield from process(chunk)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/programs')
+def api_programs():
+    page, per_page = api.page_from_args(request.args)
+    return jsonify(api.list_programs(get_rehab_system(), api.filters_from_args(request.args), page, per_page))
+
+@app.route('/api/programs/<program_name>')
+def api_program_detail(program_name):
+    program = api.program_details(get_rehab_system(), program_name)
+    if not program:
+        return jsonify(error='Программа не найдена'), 404
+    return jsonify(program)
+
+@app.route('/api/match', methods=['POST'])
+@app.route('/api/find-program', methods=['POST'])
+def api_match():
+    """Подбор программ: JSON с данными пациента (поля как в форме /find-program)"""
+    payload = request.get_json(silent=True)
+    try:
+        patient_data = api.patient_from_payload(payload)
+        limit = request.args.get('limit', type=int)
+        if limit is None and isinstance(payload, dict) and payload.get('limit') is not None:
+            limit = int(payload['limit'])
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    explain = request.args.get('explain') == '1' or (isinstance(payload, dict) and payload.get('explain') is True)
+    
+    return jsonify(api.match(get_rehab_system(), patient_data, limit, explain))
+
+@app.route('/api/similar-patients', methods=['POST'])
+def api_similar_patients():
+    """Похожие пациенты онтологии и их программы: JSON с данными пациента, ?k=N — число пациентов"""
+    payload = request.get_json(silent=True)
+    try:
+        patient_data = api.patient_from_payload(payload)
+        k = request.args.get('k', type=int)
+        if k is None and isinstance(payload, dict) and payload.get('k') is not None:
+            k = int(payload['k'])
+        if k is not None and k < 1:
+            raise ValueError(f'k должно быть не меньше 1, получено {k}')
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    
+    return jsonify(api.similar(get_rehab_system(), patient_data, k))
+
 @app.route('/all-programs')
 def all_programs():
-    programs = rehab_system.get_all_programs()
-    print(f"Всего программ для отображения: {len(programs)}")
-    return render_template('all_programs.html', programs=programs)
+    system = get_rehab_system()
+    
+    def render():
+        page, per_page = api.page_from_args(request.args)
+        listing = api.list_programs(system, api.filters_from_args(request.args), page, per_page)
+        logger.debug("all-programs total=%d page=%d", listing['total'], listing['page'])
+        return _render('all_programs.html', programs=listing['programs'], listing=listing)
+    
+    return _cached_page(system, render)
 
 @app.route('/program/<program_name>')
 def program_detail(program_name):
-    program = rehab_system.get_program_details(program_name)
+    system = get_rehab_system()
+    program = api.program_details(system, program_name)
     if not program:
         flash('Программа не найдена', 'error')
         return render_template('all_programs.html')
     
-    return render_template('program_detail.html', program=program)
+    return _cached_page(system, lambda: _render('program_detail.html', program=program))
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/healthz')
+def healthz():
+    """Проверка жизнеспособности: процесс отвечает (онтология может еще загружаться)"""
+    return jsonify(status='ok')
+
+@app.route('/readyz')
+def readyz():
+    """Проверка готовности: основная онтология загружена и скомпилирована"""
+    snapshot = ontology_manager.current
+    if snapshot is None:
+        return jsonify(status='starting', attempts=startup['attempts'], error=ontology_manager.last_error), 503
+    return jsonify(status='ready', startup_seconds=startup['ready_seconds'], **snapshot.info())
+
+@app.route('/admin/reload-ontology', methods=['POST'])
+def reload_ontology():
+    """Перезагрузить онтологию в фоне; ?wait=1 дождаться подмены"""
+    _require_admin()
+    force = request.args.get('force') == '1'
+    manager = get_ontology_manager()
+    thread = manager.reload_in_background(force=force)
+    if request.args.get('wait') == '1':
+        thread.join()
+        return jsonify(status='done', error=manager.last_error, **manager.current.info())
+    return jsonify(status='reloading', **manager.current.info()), 202
+
+def _admin_edit(change, describe):
+    """Применить правку онтологии и вернуть новую версию с описанием измененной сущности"""
+    import ontology_edit
+    _require_admin()
+    try:
+        snapshot = get_ontology_manager().edit(change)
+    except ontology_edit.EntityNotFound as e:
+        return jsonify(error=str(e)), 404
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except OntologyEditError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(status='done', **describe(snapshot.system), **snapshot.info())
+
+@app.route('/admin/programs/<program_name>', methods=['PUT', 'DELETE'])
+def admin_program(program_name):
+    """PUT — создать программу или изменить свойства из JSON-тела, DELETE — удалить"""
+    import ontology_edit
+    if request.method == 'DELETE':
+        change = lambda onto, system: ontology_edit.delete_program(onto, system, program_name)
+    else:
+        payload = request.get_json(silent=True)
+        change = lambda onto, system: ontology_edit.put_program(onto, system, program_name, payload)
+    return _admin_edit(change, lambda system: {'program': system.get_program_details(program_name)})
+
+@app.route('/admin/patients/<patient_name>', methods=['PUT', 'DELETE'])
+def admin_patient(patient_name):
+    """PUT — создать пациента (архетип) или изменить свойства из JSON-тела, DELETE — удалить"""
+    import ontology_edit
+    if request.method == 'DELETE':
+        change = lambda onto, system: ontology_edit.delete_patient(onto, system, patient_name)
+    else:
+        payload = request.get_json(silent=True)
+        change = lambda onto, system: ontology_edit.put_patient(onto, system, patient_name, payload)
+    
+    def describe(system):
+        patient = next((p for p in system.catalog.patients if p.name == patient_name), None)
+        return {'patient': patient.to_dict() if patient else None}
+    
+    return _admin_edit(change, describe)
+
+# Те же страницы и API для отдельной клиники: /t/<клиника>/find-program и т.д.
+TENANT_ENDPOINTS = (
+    'index', 'patient_form', 'find_program', 'find_programs_batch', 'api_programs', 'api_program_detail',
+    'api_match', 'api_similar_patients', 'all_programs', 'program_detail', 'reload_ontology', 'admin_program', 'admin_patient',
+)
+for rule in list(app.url_map.iter_rules()):
+    if rule.endpoint in TENANT_ENDPOINTS:
+        app.add_url_rule('/t/<clinic>' + rule.rule, rule.endpoint,
+                         methods=sorted(rule.methods - {'HEAD', 'OPTIONS'}))
+
+startup['import_seconds'] = time.perf_counter() - STARTUP_STARTED
+logger.info("Приложение импортировано за %.2f с", startup['import_seconds'])
 
 if __name__ == '__main__':
-    port = 5001
-    app.run(debug=True, host='0.0.0.0', port=port, use_reloader=False)
\ No newline at end of file
+    # Сервер разработки; в продакшене: gunicorn -c gunicorn.conf.py app:app
+    start_warmup()
+    port = int(os.environ.get('PORT', 5001))
+    app.run(host='0.0.0.0', port=port, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""Замеры производительности подбора программ на синтетических онтологиях.
+
+Для каждого масштаба генерируется онтология (см. synthetic_ontology), строится
+RehabilitationSystem и вызываются get_all_programs, find_optimal_programs,
+find_similar_patients и get_program_details. Для каждой точки входа
+сохраняются пропускная способность, перцентили задержки и пиковая память
+(tracemalloc).
+
+Каждый масштаб прогоняется для всех способов чтения онтологии из --backends
+(python — обход сущностей owlready2, sparql — подготовленные SPARQL-запросы);
+для них дополнительно замеряется чтение одной программы по точному IRI.
+
+Пример:
+    python -m benchmarks.bench_matching --scales 10 100 1000 --requests 200
+    python -m benchmarks.bench_matching --scales 10 --backends python sparql
+    python -m benchmarks.bench_matching --scales 10 --compare benchmarks/results/prev.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from app import RehabilitationSystem
+from benchmarks.synthetic_ontology import generate
+from catalog import BACKENDS, _program_record
+from sparql_backend import SparqlRetriever
+
+DEFAULT_SCALES = [10, 100, 1000]
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+
+SEVERITIES = ['легкая', 'средняя', 'тяжелая']
+MOVEMENT_LEVELS = ['none', 'mild', 'medium', 'severe']
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0..100) по отсортированной выборке"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def random_patient(system, rnd):
+    """Случайная анкета из словарей системы (как из формы /find-program)"""
+    return {
+        'diagnosis': rnd.choice(list(system.condition_mapping)),
+        'severity': rnd.choice(SEVERITIES),
+        'age_group': 'взрослый',
+        'goals': rnd.sample(list(system.goal_translation), rnd.randint(0, 3)),
+        'movement_impairment': rnd.choice(MOVEMENT_LEVELS),
+        'target': rnd.choice(list(system.target_translation)),
+    }
+
+
+def measure(call, arguments, max_seconds, memory_calls=20):
+    """Выполнить call для каждого набора аргументов и собрать статистику.
+
+    Задержки замеряются без tracemalloc (он замедляет выделение памяти), пиковая
+    память — отдельным коротким прогоном.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for args in arguments:
+        t0 = time.perf_counter()
+        call(*args)
+        latencies.append(time.perf_counter() - t0)
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for args in arguments[:min(memory_calls, len(latencies))]:
+        call(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'seconds': elapsed,
+        'throughput_per_s': len(latencies) / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'p50': _ms(percentile(latencies, 50)),
+            'p90': _ms(percentile(latencies, 90)),
+            'p99': _ms(percentile(latencies, 99)),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+        'peak_memory_bytes': peak,
+    }
+
+
+def _ms(value):
+    return None if value is None else value * 1000
+
+
+def program_lookup(onto, backend):
+    """Чтение одной программы по точному IRI выбранным способом"""
+    if backend == 'sparql':
+        return SparqlRetriever(onto).program
+    return lambda iri: _program_record(onto.world[iri])
+
+
+def run_scale(scale, requests, max_seconds, seed, backend='python'):
+    rnd = random.Random(seed)
+
+    t0 = time.perf_counter()
+    onto = generate(scale, seed)
+    generate_seconds = time.perf_counter() - t0
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    # Кэш результатов отключен: замеряется сам подбор, а не попадания в кэш
+    system = RehabilitationSystem(onto, cache_size=0, backend=backend)
+    build_seconds = time.perf_counter() - t0
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    program_names = [program.name for program in system.catalog.programs]
+    patients = [(random_patient(system, rnd),) for _ in range(requests)]
+    detail_names = [(rnd.choice(program_names),) for _ in range(requests)]
+    detail_iris = [(onto.base_iri + name,) for (name,) in detail_names]
+
+    return {
+        'scale': scale,
+        'backend': backend,
+        'programs': len(system.catalog),
+        'patients': len(system.catalog.patients),
+        'individuals': len(system.catalog.individuals),
+        'generate_seconds': generate_seconds,
+        'build': {'seconds': build_seconds, 'peak_memory_bytes': build_peak},
+        'entry_points': {
+            'get_all_programs': measure(system.get_all_programs, [()] * requests, max_seconds),
+            'find_optimal_programs': measure(system.find_optimal_programs, patients, max_seconds),
+            'find_similar_patients': measure(system.find_similar_patients, patients, max_seconds),
+            'get_program_details': measure(system.get_program_details, detail_names, max_seconds),
+            'program_by_iri': measure(program_lookup(onto, backend), detail_iris, max_seconds),
+        },
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    import numpy
+    import owlready2
+    return {
+        'commit': commit or None,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': numpy.__version__,
+        'owlready2': getattr(owlready2, 'VERSION', None),
+    }
+
+
+def compare(current, previous):
+    """Вывести изменение медианной задержки относительно прошлого прогона"""
+    previous_by_scale = {
+        (entry['scale'], entry.get('backend', 'python')): entry for entry in previous['results']
+    }
+    for entry in current['results']:
+        old = previous_by_scale.get((entry['scale'], entry.get('backend', 'python')))
+        if not old:
+            continue
+        for name, stats in entry['entry_points'].items():
+            old_stats = old['entry_points'].get(name)
+            if not old_stats or not old_stats['latency_ms']['p50'] or not stats['latency_ms']['p50']:
+                continue
+            ratio = stats['latency_ms']['p50'] / old_stats['latency_ms']['p50']
+            print(f"x{entry['scale']:<5} {entry.get('backend', 'python'):<7} {name:<24} p50 {old_stats['latency_ms']['p50']:9.3f} -> "
+                  f"{stats['latency_ms']['p50']:9.3f} ms ({ratio:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['python'],
+                        help='способы чтения онтологии')
+    parser.add_argument('--requests', type=int, default=200, help='вызовов на каждую точку входа')
+    parser.add_argument('--max-seconds', type=float, default=60, help='ограничение времени на точку входа')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл результатов (по умолчанию benchmarks/results/<время>.json)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    report = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'parameters': {'requests': args.requests, 'max_seconds': args.max_seconds, 'seed': args.seed,
+                       'backends': args.backends},
+        'results': [],
+    }
+    for scale in args.scales:
+        for backend in args.backends:
+            entry = run_scale(scale, args.requests, args.max_seconds, args.seed, backend)
+            report['results'].append(entry)
+            print(f"x{scale:<5} {backend:<7} {'build':<24} {entry['build']['seconds'] * 1000:9.1f} ms")
+            for name, stats in entry['entry_points'].items():
+                print(f"x{scale:<5} {backend:<7} {name:<24} {stats['calls']:6d} calls  "
+                      f"{stats['throughput_per_s']:10.1f}/s  p50 {stats['latency_ms']['p50']:9.3f} ms  "
+                      f"p99 {stats['latency_ms']['p99']:9.3f} ms  peak {stats['peak_memory_bytes'] / 1e6:8.2f} MB")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Результаты сохранены в {output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
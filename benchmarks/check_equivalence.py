@@ -0,0 +1,400 @@
+"""Проверка совпадения подбора с исходной реализацией и способов чтения онтологии.
+
+Эталон подбора — перенесенный без изменений подбор из первой версии app.py:
+обход индивидов онтологии для каждой программы, баллы по ключевым словам
+методов, цели и конкретному пациенту. Для синтетических онтологий заданных
+масштабов (см. synthetic_ontology) перебираются анкеты по всем диагнозам,
+степеням тяжести, уровням движения и целям; первые пять программ и их баллы
+должны совпадать с RehabilitationSystem.find_optimal_programs.
+
+Каталоги, построенные разными способами чтения (catalog.BACKENDS), должны
+совпадать целиком, включая порядок значений: get_all_programs,
+get_program_details каждой программы, пациенты, индивиды и индексы
+диагнозов. В онтологию добавляются пациенты, на которых правила сопоставления
+диагнозов легко разойтись: диагноз только в метке и диагноз во втором
+комментарии (отображаемое имя берется из первого).
+
+Правки онтологии (ontology_edit) обновляют каталог, матрицу признаков,
+индексы диагнозов, кэш результатов и индекс похожих пациентов только для
+затронутых записей (RehabilitationSystem.updated). check_edits выполняет
+случайные правки программ и пациентов и после каждой сравнивает обновленную
+систему с построенной заново по той же онтологии.
+
+Пример:
+    python -m benchmarks.check_equivalence --scales 1 3 --edits 200
+"""
+
+import argparse
+import itertools
+import random
+import sys
+
+from app import RehabilitationSystem
+from benchmarks.synthetic_ontology import PATIENT_MOVEMENT, TARGETS, generate, reload_in_new_world
+from catalog import BACKENDS
+from ontology_edit import delete_patient, delete_program, put_patient, put_program
+from scoring import GOAL_METHOD_MAP, IMPAIRMENT_METHOD_MAP, TARGET_METHOD_MAP
+from similarity import AGE_LEVELS, PAIN_LEVELS
+
+SEVERITIES = ['легкая', 'средняя', 'тяжелая']
+MOVEMENT_LEVELS = ['', 'none', 'mild', 'medium', 'moderate', 'severe', 'paralysis']
+LIMIT = 5
+
+
+def _display_name(entity):
+    if not hasattr(entity, 'name'):
+        # Значения свойств данных (цели) исходная версия показывала как есть
+        return str(entity)
+    if entity.comment and str(entity.comment[0]).strip():
+        return str(entity.comment[0])
+    if entity.label and str(entity.label[0]).strip():
+        return str(entity.label[0])
+    name = entity.name.replace('_', ' ')
+    for word in ('program', 'Program', 'программа', 'Программа'):
+        name = name.replace(word, '')
+    return name.strip().title()
+
+
+def _related(entity, *property_names):
+    result = []
+    for name in property_names:
+        for item in getattr(entity, name, None) or []:
+            result.append(_display_name(item))
+    return result
+
+
+def _first(values):
+    return str(values[0]).lower() if values else ''
+
+
+class BaselineMatcher:
+    """Подбор программ по правилам исходной версии (без кэшей и индексов)"""
+
+    def __init__(self, onto, condition_mapping, target_translation):
+        self.onto = onto
+        self.condition_mapping = condition_mapping
+        self.target_translation = target_translation
+        self.programs = self._program_instances()
+        self.patients = [
+            patient for cls in onto.classes() if 'Пациент' in str(cls) or 'Patient' in str(cls)
+            for patient in cls.instances()
+        ]
+        self.individuals = [(individual, _display_name(individual)) for individual in onto.individuals()]
+
+    def _program_instances(self):
+        for cls in self.onto.classes():
+            if 'Программа' in str(cls) or 'Program' in str(cls):
+                return list(cls.instances())
+        return []
+
+    def _matches_diagnosis(self, program_patients, possible_names):
+        for display in program_patients:
+            for individual, individual_display in self.individuals:
+                if individual_display == display and any(
+                        name in individual.name or name in individual_display for name in possible_names):
+                    return True
+        return False
+
+    def _patient_specific(self, diagnosis, movement_impairment, target, program):
+        suitable = {patient.name for patient in getattr(program, 'suitableFor', None) or []}
+        for patient in self.patients:
+            if not any(name in patient.name for name in self.condition_mapping.get(diagnosis, [])):
+                continue
+            if patient.name in suitable:
+                score = 5
+                movement = _first(getattr(patient, 'hasMovementImpairment', None))
+                if movement_impairment and movement and movement_impairment in movement:
+                    score += 5
+                patient_target = _first(getattr(patient, 'hasTarget', None))
+                if target and patient_target and target in patient_target:
+                    score += 5
+                return score
+        return 0
+
+    def find_optimal_programs(self, patient_data):
+        """Первые LIMIT программ: список (имя, балл)"""
+        diagnosis = patient_data['diagnosis'].lower()
+        movement_impairment = patient_data.get('movement_impairment', '').lower()
+        target = patient_data.get('target', '')
+        possible_names = self.condition_mapping.get(diagnosis, [])
+
+        ranked = []
+        for program in self.programs:
+            if not self._matches_diagnosis(_related(program, 'suitableFor', 'подходитДля'), possible_names):
+                continue
+            methods = [method.lower() for method in _related(program, 'includesMethod', 'включаетМетод')]
+            score = 50
+            for goal in patient_data.get('goals', []):
+                if any(keyword in method for keyword in GOAL_METHOD_MAP.get(goal, []) for method in methods):
+                    score += 10
+            severity = patient_data.get('severity', '')
+            if severity == 'тяжелая' and any('робот' in method for method in methods):
+                score += 15
+            elif severity == 'легкая' and any('лфк' in method for method in methods):
+                score += 10
+            if movement_impairment and any(
+                    keyword in method for keyword in IMPAIRMENT_METHOD_MAP.get(movement_impairment, [])
+                    for method in methods):
+                score += 5
+            if target:
+                words = target.lower().split('_')
+                translated = self.target_translation.get(target, target).lower()
+                for program_target in (t.lower() for t in _related(program, 'hasTarget', 'имеетЦелевуюГруппу')):
+                    if target.lower() in program_target or translated in program_target or any(
+                            word in program_target for word in words):
+                        score += 10
+                        break
+                if any(keyword in method for keyword in TARGET_METHOD_MAP.get(target, []) for method in methods):
+                    score += 5
+            score += self._patient_specific(diagnosis, movement_impairment, target, program)
+            ranked.append((program.name, min(score, 100)))
+
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:LIMIT]
+
+
+def add_annotation_cases(onto):
+    """Добавить пациентов с диагнозом только в метке и во втором комментарии
+    и программы для них; вернуть онтологию, перезагруженную в новый мир"""
+    method = next(iter(onto.RehabilitationMethod.instances()))
+    with onto:
+        label_only = onto.Patient('patient_label_only')
+        label_only.label = ['Пациент_Артрит (только метка)']
+        two_comments = onto.Patient('patient_two_comments')
+        two_comments.comment = ['Пациентка без диагноза в первом комментарии', 'Пациент_ДЦП']
+        for patient in (label_only, two_comments):
+            program = onto.RehabilitationProgram(f'program_for_{patient.name}')
+            program.comment = [f'Программа для {patient.name}']
+            program.includesMethod = [method]
+            program.suitableFor = [patient]
+    return reload_in_new_world(onto)
+
+
+def profiles(system, seed=0):
+    """Анкеты по всем сочетаниям диагноза, тяжести, уровня движения и цели"""
+    rnd = random.Random(seed)
+    goals = list(system.goal_translation)
+    for diagnosis, severity, movement, target in itertools.product(
+            system.condition_mapping, SEVERITIES, MOVEMENT_LEVELS, ['', *system.target_translation]):
+        yield {
+            'diagnosis': diagnosis,
+            'severity': severity,
+            'age_group': 'взрослый',
+            'movement_impairment': movement,
+            'target': target,
+            'goals': rnd.sample(goals, rnd.randint(0, 3)),
+        }
+
+
+def check_matching(onto, seed=0):
+    """Число анкет и список расхождений (анкета, эталон, результат) с исходным подбором"""
+    system = RehabilitationSystem(onto, cache_size=0, top_k=LIMIT)
+    baseline = BaselineMatcher(onto, system.condition_mapping, system.target_translation)
+    checked = 0
+    mismatches = []
+    for patient_data in profiles(system, seed):
+        checked += 1
+        expected = baseline.find_optimal_programs(patient_data)
+        actual = [(program['name'], program['score']) for program in system.find_optimal_programs(patient_data)]
+        if actual != expected:
+            mismatches.append((patient_data, expected, actual))
+    return checked, mismatches
+
+
+def _catalog_view(system):
+    """Все, что каталог отдает наружу, в сравнимом виде"""
+    return {
+        'get_all_programs': system.get_all_programs(),
+        **{
+            f'get_program_details({program.name})': system.get_program_details(program.name)
+            for program in system.catalog.programs
+        },
+        'patients': [patient.to_dict() for patient in system.catalog.patients],
+        'individuals': list(system.catalog.individuals),
+        **{
+            f'program_ids_for_diagnosis({diagnosis})': [
+                system.catalog.programs[program_id].name
+                for program_id in system.catalog.program_ids_for_diagnosis(diagnosis)
+            ]
+            for diagnosis in system.condition_mapping
+        },
+        'diagnosis_patients': {
+            diagnosis: sorted(names) for diagnosis, names in system.catalog.diagnosis_patients.items()
+        },
+    }
+
+
+def check_backends(onto):
+    """Число сравненных частей каталога и список расхождений (часть, значения по способам)"""
+    views = {backend: _catalog_view(RehabilitationSystem(onto, cache_size=0, backend=backend))
+             for backend in BACKENDS}
+    reference = views[BACKENDS[0]]
+    mismatches = []
+    for key in reference:
+        values = {backend: view.get(key) for backend, view in views.items()}
+        if any(value != reference[key] for value in values.values()):
+            mismatches.append((key, values))
+    return len(reference), mismatches
+
+
+def _random_edit(onto, rnd, step):
+    """Случайная правка: (функция ontology_edit, имя сущности, тело правки)"""
+    programs = [program.name for program in onto.RehabilitationProgram.instances()]
+    patients = [patient.name for patient in onto.Patient.instances()]
+    kind = rnd.random()
+    if kind < 0.15 and len(programs) > 1:
+        return delete_program, rnd.choice(programs), None
+    if kind < 0.25 and len(patients) > 1:
+        return delete_patient, rnd.choice(patients), None
+
+    annotations = {}
+    if rnd.random() < 0.3:
+        # Отображаемое имя может добавить или убрать совпадение с диагнозом
+        annotations[rnd.choice(['comment', 'label'])] = rnd.choice(
+            [f'Запись {step}', 'Пациент_Артрит', 'Пациент_ДЦП', ''])
+    if kind < 0.6:
+        name = rnd.choice(programs) if rnd.random() < 0.7 else f'program_edit_{step}'
+        fields = {
+            'hasDuration': rnd.randint(10, 90),
+            'hasSessionCount': rnd.randint(5, 40),
+            'includesMethod': rnd.sample([method.name for method in onto.RehabilitationMethod.instances()],
+                                         rnd.randint(0, 3)),
+            'suitableFor': rnd.sample(patients, min(len(patients), rnd.randint(0, 3))),
+            'supervisedBy': rnd.sample([specialist.name for specialist in onto.Specialist.instances()],
+                                       rnd.randint(0, 2)),
+            'hasTarget': rnd.sample(TARGETS, rnd.randint(0, 2)),
+        }
+        return put_program, name, {**dict(rnd.sample(sorted(fields.items()), rnd.randint(1, 4))), **annotations}
+
+    name = rnd.choice(patients) if rnd.random() < 0.6 else rnd.choice(
+        [f'patient_edit_{step}', f'Пациент_Артрит_{step}', f'patient_stroke_mild_{step}'])
+    fields = {
+        # Новые состояния и цели расширяют словари индекса похожих пациентов
+        'hasCondition': rnd.choice(['Инсульт', 'Артрит', f'Состояние {step}']),
+        'hasSeverity': rnd.choice(SEVERITIES),
+        'hasAgeGroup': rnd.choice(list(AGE_LEVELS)),
+        'hasMovementImpairment': rnd.choice(PATIENT_MOVEMENT),
+        'hasTarget': rnd.choice([*TARGETS, f'Цель {step}']),
+        'hasPainLevel': rnd.choice(list(PAIN_LEVELS)),
+    }
+    fields = {field: value for field, value in fields.items() if onto[field] is not None}
+    return put_patient, name, {**dict(rnd.sample(sorted(fields.items()), rnd.randint(1, len(fields)))),
+                               **annotations}
+
+
+def _archetype_rows(index):
+    """Строки матрицы похожих пациентов по именам столбцов (порядок столбцов
+    категорий зависит от истории правок)"""
+    labels = {}
+    for block, columns in index._columns.items():
+        labels.update({column: (block, value) for value, column in columns.items()})
+    for block, (_, profiles) in index._ordinals.items():
+        start = index._slices[block].start
+        labels.update({start + level: (block, level) for level in range(len(profiles))})
+    return {
+        patient.name: sorted((labels[column], round(float(row[column]), 5)) for column in row.nonzero()[0])
+        for patient, row in zip(index.patients, index.features)
+    }
+
+
+def _edit_view(system, patients_data):
+    """Каталог, индексы, матрицы, результаты подбора и похожие пациенты в сравнимом виде"""
+    catalog = system.catalog
+    names = [program.name for program in catalog.programs]
+    archetypes = system.archetypes
+    patient_names = [patient.name for patient in archetypes.patients]
+    return {
+        **_catalog_view(system),
+        'methods': [(method.name, method.display_name, method.effectiveness) for method in catalog.methods],
+        'specialists': list(catalog.specialists),
+        'diagnosis_displays': {
+            diagnosis: sorted(displays) for diagnosis, displays in catalog.diagnosis_displays.items()
+        },
+        'patient_matches': {
+            diagnosis: {names[program_id]: patient.name for program_id, patient in sorted(matches.items())}
+            for diagnosis, matches in catalog.patient_matches.items() if matches
+        },
+        'facets': {
+            facet: {value: sorted(names[program_id] for program_id in ids) for value, ids in index.items()}
+            for facet, index in catalog.facets.items()
+        },
+        'scoring.features': system.scoring.features.tolist(),
+        'scoring.program_targets': list(system.scoring._program_targets),
+        'find_optimal_programs': [system.find_optimal_programs(patient_data) for patient_data in patients_data],
+        'archetypes.features': _archetype_rows(archetypes),
+        'archetypes.programs_by_patient': {
+            patient_names[row]: [names[program_id] for program_id in ids]
+            for row, ids in enumerate(archetypes.programs_by_patient)
+        },
+        # При равной близости порядок зависит от округления float32, поэтому
+        # ближайшие сравниваются по округленной близости
+        'archetypes.nearest': [
+            sorted((-round(score, 5), patient_names[row]) for row, score in result)
+            for result in archetypes.nearest_batch(patients_data, len(archetypes))
+        ],
+    }
+
+
+def check_edits(onto, steps, seed=0, sample=40):
+    """Число правок и список расхождений (шаг, правка, часть, после правки, заново)
+    обновленной системы с построенной заново"""
+    rnd = random.Random(seed)
+    system = RehabilitationSystem(onto, top_k=LIMIT)
+    all_profiles = list(profiles(system, seed))
+    mismatches = []
+    for step in range(steps):
+        patients_data = rnd.sample(all_profiles, sample)
+        # Кэш результатов заполняется до правки: после нее в нем должны остаться
+        # только записи, которые правка не затронула
+        for patient_data in patients_data:
+            system.find_optimal_programs(patient_data)
+        edit, name, payload = _random_edit(onto, rnd, step)
+        changes = edit(onto, system, name) if payload is None else edit(onto, system, name, payload)
+        system = system.updated(**changes)
+
+        expected = _edit_view(RehabilitationSystem(onto, cache_size=0, top_k=LIMIT), patients_data)
+        actual = _edit_view(system, patients_data)
+        for key in expected:
+            if actual.get(key) != expected[key]:
+                mismatches.append((step, (edit.__name__, name, payload), key, actual.get(key), expected[key]))
+        if mismatches:
+            # Следующие шаги строятся на разошедшейся системе
+            break
+    return step + 1, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--edits', type=int, default=100, help='число случайных правок (0 — не проверять правки)')
+    args = parser.parse_args()
+
+    failed = False
+    for scale in args.scales:
+        onto = add_annotation_cases(generate(scale, args.seed))
+        checked, mismatches = check_matching(onto, args.seed)
+        print(f"x{scale:<5} find_optimal_programs  {checked} анкет, расхождений: {len(mismatches)}")
+        for patient_data, expected, actual in mismatches[:3]:
+            print(f"    {patient_data}\n      ожидалось {expected}\n      получено  {actual}")
+        failed = failed or bool(mismatches)
+
+        checked, mismatches = check_backends(onto)
+        print(f"x{scale:<5} {' / '.join(BACKENDS):<22} {checked} частей каталога, расхождений: {len(mismatches)}")
+        for key, values in mismatches[:3]:
+            print(f"    {key}")
+            for backend, value in values.items():
+                print(f"      {backend:<7} {value}")
+        failed = failed or bool(mismatches)
+
+        if args.edits:
+            checked, mismatches = check_edits(onto, args.edits, args.seed)
+            print(f"x{scale:<5} updated                {checked} правок, расхождений: {len(mismatches)}")
+            for step, edit, key, actual, expected in mismatches[:3]:
+                print(f"    шаг {step} {edit}: {key}\n      после правки {actual}\n      заново       {expected}")
+            failed = failed or bool(mismatches)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
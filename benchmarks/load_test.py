@@ -0,0 +1,276 @@
+"""Нагрузочный тест запущенного сервера.
+
+Смесь маршрутов /find-program, /all-programs и /program/<имя> подается на
+сервер либо с фиксированным числом одновременных клиентов (--concurrency),
+либо с фиксированной частотой поступления запросов (--rate). Анкеты пациентов
+берутся из JSONL-файла (--payloads, по объекту на строку, поля как в форме
+подбора) или генерируются из словарей RehabilitationSystem. Для каждого
+маршрута выводятся пропускная способность, перцентили задержки и доля ошибок.
+
+Ошибки проверки и обработки анкеты /find-program отвечает с кодом 200, снова
+показывая форму с сообщением; такие ответы учитываются как ошибки со
+статусом "200-form".
+
+Пример:
+    python -m benchmarks.load_test --url http://localhost:5001 --concurrency 16 --duration 30
+    python -m benchmarks.load_test --rate 200 --duration 60 --mix find-program=5,all-programs=3,program=2
+    python -m benchmarks.load_test --payloads recorded.jsonl --output benchmarks/results/load.json
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from api import patient_from_payload
+from benchmarks.bench_matching import percentile, random_patient
+
+DEFAULT_MIX = 'find-program=6,all-programs=2,program=2'
+ROUTES = ('find-program', 'all-programs', 'program')
+# Форма анкеты (patient_form.html): /find-program возвращает ее вместо результатов при ошибке
+FORM_PAGE_MARKER = b'id="patientForm"'
+FORM_PAGE_STATUS = '200-form'
+
+
+def parse_mix(text):
+    """'find-program=6,all-programs=2' -> {'find-program': 6, 'all-programs': 2}"""
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f'неизвестный маршрут {route!r}, доступны: {", ".join(ROUTES)}')
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def load_payloads(path):
+    """Анкеты из JSONL-файла; строки без полей анкеты пропускаются"""
+    payloads = []
+    skipped = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                payloads.append(patient_from_payload(json.loads(line)))
+            except ValueError:
+                skipped += 1
+    if skipped:
+        print(f'Пропущено строк без данных пациента: {skipped}', file=sys.stderr)
+    return payloads
+
+
+def synthesize_payloads(count, rnd):
+    """Случайные анкеты из словарей RehabilitationSystem"""
+    from app import RehabilitationSystem
+    vocabulary = RehabilitationSystem(None, cache_size=0)
+    return [random_patient(vocabulary, rnd) for _ in range(count)]
+
+
+def fetch_program_names(base_url):
+    """Имена программ с сервера (через /api/programs)"""
+    names = []
+    page = 1
+    while True:
+        with urllib.request.urlopen(f'{base_url}/api/programs?per_page=100&page={page}') as response:
+            listing = json.load(response)
+        names.extend(program['name'] for program in listing['programs'])
+        if page >= listing['pages']:
+            return names
+        page += 1
+
+
+class RouteStats:
+    """Задержки и ошибки одного маршрута"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_codes = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, status):
+        with self._lock:
+            self.latencies.append(latency)
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'throughput_per_s': count / elapsed if elapsed else None,
+            'error_rate': self.errors / count if count else None,
+            'status_codes': {str(code): n for code, n in sorted(self.status_codes.items(), key=str)},
+            'latency_ms': {
+                'mean': sum(latencies) / count * 1000 if count else None,
+                'p50': _ms(percentile(latencies, 50)),
+                'p90': _ms(percentile(latencies, 90)),
+                'p99': _ms(percentile(latencies, 99)),
+                'max': _ms(latencies[-1] if latencies else None),
+            },
+        }
+
+
+def _ms(value):
+    return None if value is None else value * 1000
+
+
+class LoadGenerator:
+    def __init__(self, base_url, mix, payloads, program_names, timeout, seed):
+        self.base_url = base_url.rstrip('/')
+        self.routes = list(mix)
+        self.weights = [mix[route] for route in self.routes]
+        self.payloads = payloads
+        self.program_names = program_names
+        self.timeout = timeout
+        self.stats = {route: RouteStats() for route in self.routes}
+        self._rnd = random.Random(seed)
+        self._rnd_lock = threading.Lock()
+
+    def next_request(self):
+        """Выбрать маршрут по весам смеси и подготовить запрос"""
+        with self._rnd_lock:
+            route = self._rnd.choices(self.routes, self.weights)[0]
+            if route == 'find-program':
+                payload = self._rnd.choice(self.payloads)
+                body = urllib.parse.urlencode(payload, doseq=True).encode('utf-8')
+                return route, urllib.request.Request(f'{self.base_url}/find-program', data=body)
+            if route == 'program':
+                name = urllib.parse.quote(self._rnd.choice(self.program_names))
+                return route, urllib.request.Request(f'{self.base_url}/program/{name}')
+            return route, urllib.request.Request(f'{self.base_url}/all-programs')
+
+    def send(self, route, request, started=None):
+        """Выполнить запрос; задержка считается от started (плановое время отправки)"""
+        started = started if started is not None else time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+            if route == 'find-program' and FORM_PAGE_MARKER in body:
+                status = FORM_PAGE_STATUS
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError) as e:
+            status = type(e).__name__
+        self.stats[route].record(time.perf_counter() - started, status)
+
+    def run_closed(self, concurrency, duration, max_requests):
+        """Фиксированное число клиентов: каждый отправляет следующий запрос после ответа"""
+        deadline = time.perf_counter() + duration
+        remaining = [max_requests]
+        lock = threading.Lock()
+
+        def client():
+            while time.perf_counter() < deadline:
+                if max_requests:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.send(*self.next_request())
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, rate, duration, max_requests, max_in_flight):
+        """Фиксированная частота поступления: запросы отправляются по расписанию,
+        независимо от ответов; задержка включает ожидание свободного потока"""
+        total = int(rate * duration)
+        if max_requests:
+            total = min(total, max_requests)
+        interval = 1.0 / rate
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            for i in range(total):
+                scheduled = start + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                route, request = self.next_request()
+                pool.submit(self.send, route, request, scheduled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5001', help='адрес сервера')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'веса маршрутов (по умолчанию {DEFAULT_MIX})')
+    parser.add_argument('--payloads', help='JSONL с анкетами пациентов (иначе анкеты генерируются)')
+    parser.add_argument('--synthetic', type=int, default=500, help='сколько анкет сгенерировать')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=int, default=8, help='число одновременных клиентов')
+    mode.add_argument('--rate', type=float, help='запросов в секунду (открытая модель нагрузки)')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='предел одновременных запросов при --rate')
+    parser.add_argument('--duration', type=float, default=30, help='длительность теста, сек')
+    parser.add_argument('--requests', type=int, default=0, help='ограничить общее число запросов')
+    parser.add_argument('--warmup', type=float, default=2, help='прогрев перед замером, сек')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    payloads = load_payloads(args.payloads) if args.payloads else synthesize_payloads(args.synthetic, rnd)
+    if 'find-program' in args.mix and not payloads:
+        parser.error('нет анкет для /find-program')
+    program_names = fetch_program_names(args.url.rstrip('/')) if 'program' in args.mix else []
+    if 'program' in args.mix and not program_names:
+        parser.error('сервер не вернул ни одной программы для /program/<имя>')
+
+    if args.warmup:
+        warmup = LoadGenerator(args.url, args.mix, payloads, program_names, args.timeout, args.seed)
+        warmup.run_closed(args.concurrency if not args.rate else 4, args.warmup, 0)
+
+    generator = LoadGenerator(args.url, args.mix, payloads, program_names, args.timeout, args.seed)
+    started = time.perf_counter()
+    if args.rate:
+        generator.run_open(args.rate, args.duration, args.requests, args.max_in_flight)
+    else:
+        generator.run_closed(args.concurrency, args.duration, args.requests)
+    elapsed = time.perf_counter() - started
+
+    routes = {route: stats.summary(elapsed) for route, stats in generator.stats.items()}
+    for route, summary in routes.items():
+        latency = summary['latency_ms']
+        if not summary['requests']:
+            print(f'{route:<14} нет запросов')
+            continue
+        print(f"{route:<14} {summary['requests']:7d} req  {summary['throughput_per_s']:9.1f}/s  "
+              f"p50 {latency['p50']:8.2f} ms  p90 {latency['p90']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+              f"errors {summary['error_rate'] * 100:5.2f}%")
+    total = sum(summary['requests'] for summary in routes.values())
+    print(f"{'всего':<14} {total:7d} req  {total / elapsed:9.1f}/s  за {elapsed:.1f} с")
+
+    if args.output:
+        report = {
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'parameters': {
+                'url': args.url, 'mix': args.mix, 'concurrency': None if args.rate else args.concurrency,
+                'rate': args.rate, 'duration': args.duration, 'payloads': args.payloads or 'synthetic',
+                'seed': args.seed,
+            },
+            'elapsed_seconds': elapsed,
+            'routes': routes,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'Результаты сохранены в {args.output}')
+
+
+if __name__ == '__main__':
+    main()
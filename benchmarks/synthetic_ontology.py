@@ -0,0 +1,114 @@
+"""Генератор синтетических онтологий для нагрузочных замеров.
+
+Берет ontology/rehabilitation.owx за основу и размножает программы, пациентов,
+методы и специалистов в заданное число раз, сохраняя те же свойства
+(includesMethod, suitableFor, supervisedBy, hasTarget,
+suitableMovementImpairment, hasEffectivenessScore, ...). Имена клонов
+пациентов начинаются с исходного имени, поэтому condition_mapping
+продолжает находить их по диагнозу.
+
+Пример:
+    python -m benchmarks.synthetic_ontology --scale 100 --output /tmp/rehab_x100.owl
+"""
+
+import argparse
+import io
+import random
+import types
+
+from owlready2 import DataProperty, World
+
+from ontology_store import ONTOLOGY_PATH, release_ontology
+
+TARGETS = ['Восстановление ходьбы', 'Улучшение гибкости', 'Улучшение выносливости',
+           'Улучшение координации', 'Снижение боли', 'Восстановление бытовых навыков']
+MOVEMENT_LEVELS = ['none', 'mild', 'moderate', 'severe', 'paralysis']
+PATIENT_MOVEMENT = ['Нет ограничений', 'Легкая', 'Средняя', 'Тяжелая']
+
+
+def _first(values, default=None):
+    return values[0] if values else default
+
+
+def generate(scale, seed=0, source=ONTOLOGY_PATH):
+    """Загрузить базовую онтологию в новый мир и размножить ее индивиды в scale раз"""
+    rnd = random.Random(seed)
+    world = World()
+    onto = world.get_ontology(source).load()
+
+    base_programs = list(onto.RehabilitationProgram.instances())
+    base_patients = list(onto.Patient.instances())
+    base_methods = list(onto.RehabilitationMethod.instances())
+    base_specialists = list(onto.Specialist.instances())
+
+    with onto:
+        if onto.suitableMovementImpairment is None:
+            types.new_class('suitableMovementImpairment', (DataProperty,))
+
+        methods = list(base_methods)
+        specialists = list(base_specialists)
+        patients = list(base_patients)
+        for copy in range(1, scale):
+            for method in base_methods:
+                clone = onto.RehabilitationMethod(f'{method.name}_{copy}')
+                clone.comment = list(method.comment)
+                clone.hasEffectivenessScore = [rnd.randint(50, 100)]
+                methods.append(clone)
+            for specialist in base_specialists:
+                clone = onto.Specialist(f'{specialist.name}_{copy}')
+                clone.comment = list(specialist.comment)
+                specialists.append(clone)
+            for patient in base_patients:
+                clone = onto.Patient(f'{patient.name}_{copy}')
+                clone.comment = [f'{_first(patient.comment, patient.name)} #{copy}']
+                clone.hasCondition = list(patient.hasCondition)
+                clone.hasSeverity = list(patient.hasSeverity)
+                clone.hasAgeGroup = list(patient.hasAgeGroup)
+                clone.hasMovementImpairment = [rnd.choice(PATIENT_MOVEMENT)]
+                clone.hasTarget = [rnd.choice(TARGETS)]
+                patients.append(clone)
+
+        for copy in range(1, scale):
+            for program in base_programs:
+                clone = onto.RehabilitationProgram(f'{program.name}_{copy}')
+                clone.comment = [f'{_first(program.comment, program.name)} #{copy}']
+                clone.hasDuration = [rnd.randint(10, 90)]
+                clone.hasSessionCount = [rnd.randint(5, 40)]
+                clone.includesMethod = rnd.sample(methods, rnd.randint(1, 4))
+                clone.supervisedBy = rnd.sample(specialists, rnd.randint(1, 3))
+                clone.suitableFor = rnd.sample(patients, rnd.randint(1, 3))
+                clone.hasTarget = rnd.sample(TARGETS, rnd.randint(0, 2))
+                clone.suitableMovementImpairment = [rnd.choice(MOVEMENT_LEVELS)]
+
+    return reload_in_new_world(onto)
+
+
+def reload_in_new_world(onto):
+    """Перезагрузить онтологию в новый мир, как из файла; старый мир освобождается.
+
+    Присвоенные списки owlready2 держит в кэше сущностей в порядке
+    присваивания, а в хранилище записывает в другом. После перезагрузки
+    чтение атрибутов и SPARQL-запросы видят значения в одном порядке.
+    """
+    data = io.BytesIO()
+    onto.save(data, format='ntriples')
+    data.seek(0)
+    loaded = World().get_ontology(onto.base_iri).load(fileobj=data)
+    release_ontology(onto)
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10, help='во сколько раз увеличить онтологию')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True, help='путь к файлу RDF/XML')
+    args = parser.parse_args()
+
+    onto = generate(args.scale, args.seed)
+    onto.save(file=args.output, format='rdfxml')
+    print(f'{args.output}: {len(list(onto.individuals()))} индивидов')
+
+
+if __name__ == '__main__':
+    main()
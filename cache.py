@@ -0,0 +1,162 @@
+"""Ограниченный LRU-кэш результатов подбора программ.
+
+Ключ кэша строится по каноническому профилю пациента (см. profile_key), так что
+одинаковые анкеты, отличающиеся лишь порядком целей или регистром, попадают в
+одну запись. Одновременные промахи по одному ключу объединяются: вычисление
+выполняет первый запрос, остальные ждут его результат.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def profile_key(patient_data):
+    """Канонический ключ профиля пациента.
+
+    Учитываются только поля, влияющие на подбор. Регистр нормализуется у
+    диагноза и уровня ограничения движения (подбор и так приводит их к нижнему
+    регистру); степень тяжести и цель сравниваются точно, как при подборе.
+    """
+    goals = patient_data.get('goals', [])
+    if isinstance(goals, str):
+        goals = [goals]
+    return (
+        patient_data['diagnosis'].lower(),
+        patient_data.get('severity', ''),
+        patient_data.get('movement_impairment', '').lower(),
+        patient_data.get('target', ''),
+        tuple(sorted(goals)),
+    )
+
+
+class _Pending:
+    """Вычисление, которое уже выполняется для ключа"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Потокобезопасный LRU-кэш с TTL и счетчиками попаданий/промахов/вытеснений"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_or_compute(self, key, compute):
+        """Вернуть значение из кэша или вычислить его (один раз на ключ)"""
+        if self.maxsize <= 0:
+            return compute()
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                pending = self._pending[key] = _Pending()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = compute()
+        except BaseException as e:
+            pending.error = e
+            raise
+        else:
+            self._store(key, pending.value)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.event.set()
+
+        return pending.value
+
+    def _store(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def copy(self, keep=None):
+        """Новый кэш с теми же настройками и счетчиками и записями, ключи которых
+        проходят фильтр keep (None — все записи)"""
+        cache = ResultCache(self.maxsize, self.ttl)
+        with self._lock:
+            for key, entry in self._data.items():
+                if keep is None or keep(key):
+                    cache._data[key] = entry
+            for name in ('hits', 'misses', 'evictions', 'expirations', 'coalesced'):
+                setattr(cache, name, getattr(self, name))
+        return cache
+
+    def clear(self):
+        """Сбросить все записи (счетчики сохраняются)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'coalesced': self.coalesced,
+            }
+
+
+class CachedPage:
+    """Отрендеренная страница: тело, его gzip-версия и строгий ETag.
+
+    Тело сжимается один раз при сохранении; ETag строится из версии онтологии
+    и хэша содержимого.
+    """
+    __slots__ = ('body', 'gzipped', 'etag', 'mimetype')
+
+    def __init__(self, body, version, mimetype='text/html'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = f'{version}-{hashlib.sha256(body).hexdigest()[:16]}'
+        self.mimetype = mimetype
@@ -0,0 +1,699 @@
+"""Скомпилированный каталог программ реабилитации.
+
+Каталог строится один раз при загрузке онтологии: все обращения к атрибутам
+owlready2 и вычисление отображаемых имен выполняются здесь, а обработчики
+запросов работают уже с готовыми неизменяемыми записями.
+"""
+
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+NOT_SPECIFIED = 'Не указано'
+
+# Фасеты для фильтрации списка программ: имя фасета -> атрибут ProgramRecord
+FACET_ATTRIBUTES = {
+    'method': 'methods',
+    'specialist': 'specialists',
+    'target': 'target',
+    'patient': 'suitable_patients',
+    'movement': 'movement_impairment',
+}
+
+
+def display_name_from(name, comment=None, label=None):
+    """Отображаемое имя по имени сущности и ее первым комментарию и метке"""
+    if comment and str(comment).strip():
+        return str(comment)
+
+    if label and str(label).strip():
+        return str(label)
+
+    name = name.replace('_', ' ')
+    name = name.replace('program', '')
+    name = name.replace('Program', '')
+    name = name.replace('программа', '')
+    name = name.replace('Программа', '')
+    return name.strip().title()
+
+
+def get_display_name(entity):
+    """Получить отображаемое имя"""
+    try:
+        comment = label = None
+        if hasattr(entity, 'comment') and entity.comment:
+            comment = entity.comment[0] if isinstance(entity.comment, list) else entity.comment
+        if hasattr(entity, 'label') and entity.label:
+            label = entity.label[0] if isinstance(entity.label, list) else entity.label
+        return display_name_from(entity.name, comment, label)
+
+    except:
+        return entity.name if hasattr(entity, 'name') else str(entity)
+
+
+def get_property(entity, *property_names):
+    """Получить значение свойства"""
+    for prop_name in property_names:
+        if hasattr(entity, prop_name):
+            value = getattr(entity, prop_name)
+            if value:
+                if isinstance(value, list):
+                    return value[0] if value else NOT_SPECIFIED
+                return value
+    return NOT_SPECIFIED
+
+
+def get_related(entity, *property_names):
+    """Получить связанные сущности"""
+    result = []
+    for prop_name in property_names:
+        if hasattr(entity, prop_name):
+            related = getattr(entity, prop_name)
+            if related:
+                if isinstance(related, list):
+                    for item in related:
+                        if item:
+                            result.append(get_display_name(item))
+                else:
+                    result.append(get_display_name(related))
+    return result
+
+
+def _first_value_lower(entity, property_name):
+    """Первое значение свойства строкой в нижнем регистре ('' если не задано)"""
+    if not hasattr(entity, property_name):
+        return ''
+    value = getattr(entity, property_name)
+    if not value:
+        return ''
+    return str(value[0] if isinstance(value, list) else value).lower()
+
+
+def _values_lower(entity, property_name):
+    """Все значения свойства строками в нижнем регистре"""
+    value = getattr(entity, property_name, None)
+    if not value:
+        return ()
+    values = value if isinstance(value, list) else [value]
+    return tuple(str(item).lower() for item in values)
+
+
+def _get_first_related(entity, *property_names):
+    """Получить сущности первого непустого свойства"""
+    for prop_name in property_names:
+        value = getattr(entity, prop_name, [])
+        if value:
+            return value if isinstance(value, list) else [value]
+    return []
+
+
+class MethodRecord:
+    """Метод реабилитации с разрешенным именем и эффективностью"""
+    __slots__ = ('name', 'display_name', 'effectiveness')
+
+    def __init__(self, name, display_name, effectiveness):
+        self.name = name
+        self.display_name = display_name
+        self.effectiveness = effectiveness
+
+
+class PatientRecord:
+    """Пациент (архетип) из онтологии.
+
+    diagnoses — ключи condition_mapping, совпавшие с именем пациента; movement и
+    target — уровень ограничения движения и цель в нижнем регистре. Остальные
+    поля профиля (тоже в нижнем регистре) используются поиском похожих
+    пациентов: condition, severity, age_group, pain_level и все цели targets.
+    """
+    __slots__ = ('name', 'display_name', 'diagnoses', 'movement', 'target',
+                 'condition', 'severity', 'age_group', 'pain_level', 'targets')
+
+    def __init__(self, name, display_name, diagnoses=frozenset(), movement='', target='',
+                 condition='', severity='', age_group='', pain_level='', targets=()):
+        self.name = name
+        self.display_name = display_name
+        self.diagnoses = diagnoses
+        self.movement = movement
+        self.target = target
+        self.condition = condition
+        self.severity = severity
+        self.age_group = age_group
+        self.pain_level = pain_level
+        self.targets = tuple(targets)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'display_name': self.display_name,
+            'diagnoses': sorted(self.diagnoses),
+            'movement': self.movement,
+            'target': self.target,
+            'condition': self.condition,
+            'severity': self.severity,
+            'age_group': self.age_group,
+            'pain_level': self.pain_level,
+            'targets': list(self.targets),
+        }
+
+
+class ProgramRecord:
+    """Программа реабилитации со всеми связанными данными"""
+    __slots__ = ('name', 'display_name', 'duration', 'session_count', 'methods',
+                 'method_details', 'specialists', 'suitable_patients',
+                 'suitable_patient_names', 'target', 'detail_target',
+                 'movement_impairment')
+
+    def __init__(self, name, display_name, duration=NOT_SPECIFIED, session_count=NOT_SPECIFIED,
+                 methods=(), method_details=(), specialists=(), suitable_patients=(),
+                 suitable_patient_names=frozenset(), target=(), detail_target=(),
+                 movement_impairment=NOT_SPECIFIED):
+        self.name = name
+        self.display_name = display_name
+        self.duration = duration
+        self.session_count = session_count
+        self.methods = tuple(methods)
+        self.method_details = tuple(method_details)
+        self.specialists = tuple(specialists)
+        self.suitable_patients = tuple(suitable_patients)
+        self.suitable_patient_names = frozenset(suitable_patient_names)
+        self.target = tuple(target)
+        self.detail_target = tuple(detail_target)
+        self.movement_impairment = movement_impairment
+
+    def to_dict(self):
+        """Краткое описание программы для списков и подбора"""
+        return {
+            'name': self.name,
+            'display_name': self.display_name,
+            'duration': self.duration,
+            'session_count': self.session_count,
+            'methods': list(self.methods),
+            'specialists': list(self.specialists),
+            'suitable_patients': list(self.suitable_patients),
+            'target': list(self.target),
+            'movement_impairment': self.movement_impairment
+        }
+
+    def to_details(self):
+        """Детальное описание программы"""
+        return {
+            'name': self.name,
+            'display_name': self.display_name,
+            'duration': self.duration,
+            'session_count': self.session_count,
+            'methods': [
+                {'name': method.display_name, 'effectiveness': method.effectiveness}
+                for method in self.method_details
+            ],
+            'specialists': list(self.specialists),
+            'suitable_patients': list(self.suitable_patients),
+            'target': list(self.detail_target),
+            'movement_impairment': self.movement_impairment
+        }
+
+
+def _program_record(program):
+    """Собрать запись программы из сущности owlready2"""
+    return ProgramRecord(
+        name=program.name,
+        display_name=get_display_name(program),
+        duration=get_property(program, 'hasDuration', 'имеетДлительность'),
+        session_count=get_property(program, 'hasSessionCount', 'имеетКоличествоСеансов'),
+        methods=get_related(program, 'includesMethod', 'включаетМетод'),
+        method_details=(
+            _method_record(method)
+            for method in _get_first_related(program, 'includesMethod', 'включаетМетод')
+            if method
+        ),
+        specialists=get_related(program, 'supervisedBy', 'курируется'),
+        suitable_patients=get_related(program, 'suitableFor', 'подходитДля'),
+        suitable_patient_names=(
+            patient.name
+            for patient in _get_first_related(program, 'suitableFor', 'подходитДля')
+            if hasattr(patient, 'name')
+        ),
+        target=get_related(program, 'hasTarget', 'имеетЦелевуюГруппу'),
+        detail_target=get_related(program, 'hasTarget', 'имеетЦель'),
+        movement_impairment=get_property(program, 'suitableMovementImpairment', 'подходитДляУровняДвижения'),
+    )
+
+
+def _method_record(method):
+    """Собрать запись метода с оценкой эффективности"""
+    effectiveness = NOT_SPECIFIED
+    if hasattr(method, 'hasEffectivenessScore'):
+        eff_value = method.hasEffectivenessScore
+        if eff_value:
+            effectiveness = eff_value[0] if isinstance(eff_value, list) else eff_value
+    elif hasattr(method, 'имеетЭффективность'):
+        eff_value = method.имеетЭффективность
+        if eff_value:
+            effectiveness = eff_value[0] if isinstance(eff_value, list) else eff_value
+    return MethodRecord(method.name, get_display_name(method), effectiveness)
+
+
+def _find_program_instances(onto):
+    """Найти все экземпляры программ в онтологии"""
+    for cls in onto.classes():
+        if 'Программа' in str(cls) or 'Program' in str(cls):
+            return list(cls.instances())
+
+    instances = []
+    for cls in onto.classes():
+        for inst in cls.instances():
+            if 'program' in str(inst).lower() or 'программа' in str(inst).lower():
+                instances.append(inst)
+    return instances
+
+
+def _find_patient_instances(onto):
+    """Найти все экземпляры пациентов в онтологии"""
+    patients = []
+    for cls in onto.classes():
+        if 'Пациент' in str(cls) or 'Patient' in str(cls):
+            patients.extend(cls.instances())
+    return patients
+
+
+def _patient_record(patient, condition_mapping):
+    diagnoses = frozenset(
+        diagnosis for diagnosis, possible_names in condition_mapping.items()
+        if any(possible in patient.name for possible in possible_names)
+    )
+    return PatientRecord(
+        patient.name,
+        get_display_name(patient),
+        diagnoses,
+        _first_value_lower(patient, 'hasMovementImpairment'),
+        _first_value_lower(patient, 'hasTarget'),
+        _first_value_lower(patient, 'hasCondition'),
+        _first_value_lower(patient, 'hasSeverity'),
+        _first_value_lower(patient, 'hasAgeGroup'),
+        _first_value_lower(patient, 'hasPainLevel'),
+        _values_lower(patient, 'hasTarget'),
+    )
+
+
+def read_program(program, backend='python'):
+    """Запись одной программы из сущности owlready2 выбранным способом чтения"""
+    if backend == 'sparql':
+        from sparql_backend import SparqlRetriever
+        return SparqlRetriever(program.namespace.ontology).program(program.iri)
+    return _program_record(program)
+
+
+def _index_patient_matches(programs, patients):
+    """Построить индекс диагноз -> {номер программы: первый подходящий ей пациент}"""
+    programs_by_patient = {}
+    for program_id, program in enumerate(programs):
+        for name in program.suitable_patient_names:
+            programs_by_patient.setdefault(name, []).append(program_id)
+
+    patient_matches = {}
+    for patient in patients:
+        for program_id in programs_by_patient.get(patient.name, ()):
+            for diagnosis in patient.diagnoses:
+                patient_matches.setdefault(diagnosis, {}).setdefault(program_id, patient)
+    return patient_matches
+
+
+def _entry_matches(entry, possible_names):
+    """Совпадает ли сущность (имя, отображаемое имя) с одним из вариантов имени диагноза"""
+    name, display_name = entry
+    return any(possible in name or possible in display_name for possible in possible_names)
+
+
+def _match_individuals(individuals, possible_names):
+    """Имена и отображаемые имена сущностей, совпавших с вариантами имени диагноза"""
+    names = set()
+    displays = set()
+    for entry in individuals:
+        if _entry_matches(entry, possible_names):
+            names.add(entry[0])
+            displays.add(entry[1])
+    return frozenset(names), frozenset(displays)
+
+
+def _index_diagnoses(programs, individuals, condition_mapping):
+    """Построить индексы диагноз -> пациенты, их отображаемые имена и программы"""
+    diagnosis_patients = {}
+    diagnosis_displays = {}
+    diagnosis_programs = {}
+    for diagnosis, possible_names in condition_mapping.items():
+        matched_patients, matched_displays = _match_individuals(individuals, possible_names)
+        diagnosis_patients[diagnosis] = matched_patients
+        diagnosis_displays[diagnosis] = matched_displays
+        diagnosis_programs[diagnosis] = tuple(
+            program_id for program_id, program in enumerate(programs)
+            if not matched_displays.isdisjoint(program.suitable_patients)
+        )
+    return diagnosis_patients, diagnosis_displays, diagnosis_programs
+
+
+def _facet_values(program, attribute):
+    """Значения фасета программы строками"""
+    values = getattr(program, attribute)
+    if not isinstance(values, tuple):
+        values = (values,)
+    return {str(value) for value in values}
+
+
+def _index_facets(programs):
+    """Построить индексы фасет -> значение -> множество номеров программ"""
+    facets = {facet: {} for facet in FACET_ATTRIBUTES}
+    for program_id, program in enumerate(programs):
+        for facet, attribute in FACET_ATTRIBUTES.items():
+            for value in _facet_values(program, attribute):
+                facets[facet].setdefault(value, set()).add(program_id)
+    return {
+        facet: {value: frozenset(ids) for value, ids in index.items()}
+        for facet, index in facets.items()
+    }
+
+
+def _collect_methods(programs):
+    """Методы (по имени) и специалисты программ без повторов, в порядке появления"""
+    methods = {}
+    specialists = {}
+    for program in programs:
+        for method in program.method_details:
+            methods.setdefault(method.name, method)
+        for specialist in program.specialists:
+            specialists.setdefault(specialist, specialist)
+    return tuple(methods.values()), tuple(specialists.values())
+
+
+class ProgramCatalog:
+    """Неизменяемый снимок программ, методов, специалистов и пациентов онтологии"""
+    __slots__ = ('programs', 'by_name', 'ids_by_name', 'methods', 'specialists', 'patients',
+                 'individuals', 'condition_mapping', 'diagnosis_patients', 'diagnosis_displays',
+                 'diagnosis_programs', 'patient_matches', 'facets')
+
+    def __init__(self, programs=(), methods=(), specialists=(), patients=(), individuals=(),
+                 condition_mapping=None):
+        self.programs = tuple(programs)
+        self.by_name = {program.name: program for program in self.programs}
+        self.ids_by_name = {program.name: program_id for program_id, program in enumerate(self.programs)}
+        self.methods = tuple(methods)
+        self.specialists = tuple(specialists)
+        self.patients = tuple(patients)
+        self.individuals = tuple(individuals)
+        self.condition_mapping = condition_mapping or {}
+        self.diagnosis_patients, self.diagnosis_displays, self.diagnosis_programs = _index_diagnoses(
+            self.programs, self.individuals, self.condition_mapping
+        )
+        self.patient_matches = _index_patient_matches(self.programs, self.patients)
+        self.facets = _index_facets(self.programs)
+
+    def __len__(self):
+        return len(self.programs)
+
+    def get(self, program_name):
+        return self.by_name.get(program_name)
+
+    def program_ids_for_diagnosis(self, diagnosis):
+        """Номера программ, подходящих пациентам с данным диагнозом (в порядке каталога)"""
+        return self.diagnosis_programs.get(diagnosis, ())
+
+    def filter_program_ids(self, filters):
+        """Номера программ (в порядке каталога), подходящих под фильтры.
+
+        filters: фасет -> список значений. Значения одного фасета объединяются
+        по ИЛИ, разные фасеты — по И. Без фильтров возвращается None (все программы).
+        """
+        selected = None
+        for facet, values in filters.items():
+            index = self.facets.get(facet)
+            if index is None or not values:
+                continue
+            ids = set()
+            for value in values:
+                ids |= index.get(value, frozenset())
+            selected = ids if selected is None else selected & ids
+        if selected is None:
+            return None
+        return sorted(selected)
+
+    def facet_counts(self, program_ids=None):
+        """Количество программ по каждому значению фасетов среди program_ids (None — все)"""
+        if program_ids is None:
+            return {
+                facet: {value: len(ids) for value, ids in index.items()}
+                for facet, index in self.facets.items()
+            }
+        selected = frozenset(program_ids)
+        counts = {}
+        for facet, index in self.facets.items():
+            counts[facet] = {}
+            for value, ids in index.items():
+                count = len(selected & ids)
+                if count:
+                    counts[facet][value] = count
+        return counts
+
+    def matching_patient(self, diagnosis, program_id):
+        """Первый пациент с данным диагнозом, которому подходит программа (или None)"""
+        return self.patient_matches.get(diagnosis, {}).get(program_id)
+
+    def updated(self, programs=(), removed_programs=(), patients=(), removed_patients=()):
+        """Новый каталог с добавленными, измененными и удаленными записями.
+
+        programs и patients — новые или измененные записи (замена по имени,
+        новые добавляются в конец), removed_programs и removed_patients — имена
+        удаленных. Текущий каталог не меняется: запросы, уже получившие его,
+        дорабатывают на нем. Индексы пересчитываются только для затронутых
+        программ и диагнозов; удаление программы сдвигает номера следующих.
+
+        Возвращает (каталог, номера измененных программ в новом каталоге,
+        номера удаленных программ в текущем, затронутые диагнозы).
+        """
+        condition_mapping = self.condition_mapping
+        program_list = list(self.programs)
+        facets = {facet: dict(index) for facet, index in self.facets.items()}
+        diagnosis_programs = dict(self.diagnosis_programs)
+        patient_matches = dict(self.patient_matches)
+        affected = set()
+
+        removed_ids = sorted(self.ids_by_name[name] for name in set(removed_programs) if name in self.ids_by_name)
+        if removed_ids:
+            removed = frozenset(removed_ids)
+
+            def shift(program_id):
+                return program_id - bisect.bisect_left(removed_ids, program_id)
+
+            program_list = [program for program_id, program in enumerate(program_list) if program_id not in removed]
+            for facet, index in facets.items():
+                facets[facet] = {}
+                for value, ids in index.items():
+                    ids = frozenset(shift(program_id) for program_id in ids if program_id not in removed)
+                    if ids:
+                        facets[facet][value] = ids
+            for diagnosis, ids in diagnosis_programs.items():
+                if not removed.isdisjoint(ids):
+                    affected.add(diagnosis)
+                diagnosis_programs[diagnosis] = tuple(shift(program_id) for program_id in ids if program_id not in removed)
+            for diagnosis, matches in patient_matches.items():
+                patient_matches[diagnosis] = {
+                    shift(program_id): patient for program_id, patient in matches.items() if program_id not in removed
+                }
+            ids_by_name = {program.name: program_id for program_id, program in enumerate(program_list)}
+        else:
+            ids_by_name = dict(self.ids_by_name)
+
+        # Новые и измененные программы: обновляются только их значения в фасетах
+        changed = set()
+        for program in programs:
+            program_id = ids_by_name.get(program.name)
+            old = None
+            if program_id is None:
+                program_id = ids_by_name[program.name] = len(program_list)
+                program_list.append(program)
+            else:
+                old = program_list[program_id]
+                program_list[program_id] = program
+            for facet, attribute in FACET_ATTRIBUTES.items():
+                index = facets[facet]
+                if old is not None:
+                    for value in _facet_values(old, attribute):
+                        ids = index[value] - {program_id}
+                        if ids:
+                            index[value] = ids
+                        else:
+                            del index[value]
+                for value in _facet_values(program, attribute):
+                    index[value] = index.get(value, frozenset()) | {program_id}
+            changed.add(program_id)
+
+        # Именованные сущности: по измененным записям находятся затронутые диагнозы
+        individual_list = list(self.individuals)
+        positions = {name: position for position, (name, _) in enumerate(individual_list)}
+        changed_entries = []
+        for name in set(removed_programs) | set(removed_patients):
+            position = positions.pop(name, None)
+            if position is not None:
+                changed_entries.append(individual_list[position])
+                individual_list[position] = None
+        for record in (*programs, *patients):
+            entry = (record.name, record.display_name)
+            position = positions.get(record.name)
+            if position is None:
+                positions[record.name] = len(individual_list)
+                individual_list.append(entry)
+                changed_entries.append(entry)
+            elif individual_list[position] != entry:
+                changed_entries.extend((individual_list[position], entry))
+                individual_list[position] = entry
+        individual_list = [entry for entry in individual_list if entry is not None]
+
+        patient_list = list(self.patients)
+        patient_positions = {patient.name: position for position, patient in enumerate(patient_list)}
+        relinked_displays = set()
+        for name in set(removed_patients):
+            position = patient_positions.get(name)
+            if position is not None:
+                relinked_displays.add(patient_list[position].display_name)
+                patient_list[position] = None
+        for patient in patients:
+            position = patient_positions.get(patient.name)
+            if position is None:
+                patient_positions[patient.name] = len(patient_list)
+                patient_list.append(patient)
+            else:
+                relinked_displays.add(patient_list[position].display_name)
+                patient_list[position] = patient
+            relinked_displays.add(patient.display_name)
+        if removed_patients:
+            patient_list = [patient for patient in patient_list if patient is not None]
+            patient_positions = {patient.name: position for position, patient in enumerate(patient_list)}
+
+        diagnosis_patients = dict(self.diagnosis_patients)
+        diagnosis_displays = dict(self.diagnosis_displays)
+        patient_index = facets['patient']
+        rediagnosed = {
+            diagnosis for diagnosis, possible_names in condition_mapping.items()
+            if any(_entry_matches(entry, possible_names) for entry in changed_entries)
+        }
+        for diagnosis in rediagnosed:
+            matched_patients, matched_displays = _match_individuals(individual_list, condition_mapping[diagnosis])
+            diagnosis_patients[diagnosis] = matched_patients
+            diagnosis_displays[diagnosis] = matched_displays
+            diagnosis_programs[diagnosis] = tuple(sorted(set().union(
+                *(patient_index.get(display, ()) for display in matched_displays)
+            )))
+        affected |= rediagnosed
+
+        if changed:
+            for diagnosis, displays in diagnosis_displays.items():
+                if diagnosis in rediagnosed:
+                    continue
+                members = set(diagnosis_programs.get(diagnosis, ()))
+                updated_members = set(members)
+                for program_id in changed:
+                    if displays.isdisjoint(program_list[program_id].suitable_patients):
+                        updated_members.discard(program_id)
+                    else:
+                        updated_members.add(program_id)
+                    if program_id in members or program_id in updated_members:
+                        affected.add(diagnosis)
+                if updated_members != members:
+                    diagnosis_programs[diagnosis] = tuple(sorted(updated_members))
+
+        # Соответствие пациентам пересчитывается для измененных программ и
+        # программ, ссылающихся на измененных пациентов
+        rematched = set(changed)
+        for display in relinked_displays:
+            rematched |= patient_index.get(display, frozenset())
+        if rematched:
+            for diagnosis, matches in patient_matches.items():
+                if not rematched.isdisjoint(matches):
+                    patient_matches[diagnosis] = {
+                        program_id: patient for program_id, patient in matches.items() if program_id not in rematched
+                    }
+                    affected.add(diagnosis)
+            for program_id in sorted(rematched):
+                linked = sorted(
+                    patient_positions[name] for name in program_list[program_id].suitable_patient_names
+                    if name in patient_positions
+                )
+                for position in linked:
+                    patient = patient_list[position]
+                    for diagnosis in patient.diagnoses:
+                        matches = patient_matches.get(diagnosis)
+                        if matches is None or matches is self.patient_matches.get(diagnosis):
+                            matches = patient_matches[diagnosis] = dict(matches or {})
+                        matches.setdefault(program_id, patient)
+                        affected.add(diagnosis)
+
+        catalog = object.__new__(ProgramCatalog)
+        catalog.programs = tuple(program_list)
+        catalog.by_name = {program.name: program for program in catalog.programs}
+        catalog.ids_by_name = ids_by_name
+        catalog.methods, catalog.specialists = _collect_methods(catalog.programs)
+        catalog.patients = tuple(patient_list)
+        catalog.individuals = tuple(individual_list)
+        catalog.condition_mapping = condition_mapping
+        catalog.diagnosis_patients = diagnosis_patients
+        catalog.diagnosis_displays = diagnosis_displays
+        catalog.diagnosis_programs = diagnosis_programs
+        catalog.patient_matches = patient_matches
+        catalog.facets = facets
+        return catalog, sorted(changed), removed_ids, affected
+
+
+def _collect_programs(onto):
+    programs = []
+    try:
+        instances = _find_program_instances(onto)
+        logger.info("Найдено %d программ", len(instances))
+        for program in instances:
+            try:
+                programs.append(_program_record(program))
+            except Exception as e:
+                logger.error("Ошибка при обработке программы %s: %s", program, e)
+                continue
+    except Exception:
+        logger.exception("Ошибка при построении каталога программ")
+    return programs
+
+
+BACKENDS = ('python', 'sparql')
+
+
+def compile_catalog(onto, condition_mapping=None, backend='python'):
+    """Построить каталог по загруженной онтологии.
+
+    backend='python' обходит сущности owlready2 и читает их атрибуты,
+    backend='sparql' получает те же данные подготовленными SPARQL-запросами
+    (см. sparql_backend).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Неизвестный способ чтения онтологии: {backend!r}')
+    if not onto:
+        return ProgramCatalog()
+    condition_mapping = condition_mapping or {}
+
+    if backend == 'sparql':
+        from sparql_backend import SparqlRetriever
+        retriever = SparqlRetriever(onto)
+        programs = retriever.programs()
+        logger.info("Найдено %d программ", len(programs))
+        patients = retriever.patients(condition_mapping)
+        individuals = retriever.individuals()
+    else:
+        programs = _collect_programs(onto)
+        patients = [
+            _patient_record(patient, condition_mapping)
+            for patient in _find_patient_instances(onto)
+        ]
+        individuals = [
+            (individual.name, get_display_name(individual))
+            for individual in onto.individuals()
+            if hasattr(individual, 'name')
+        ]
+
+    methods, specialists = _collect_methods(programs)
+    # Индекс диагнозов строится по прочитанным программам и сущностям одинаково
+    # для обоих способов: вхождение имени диагноза в имя или отображаемое имя
+    # сущности и совпадение отображаемого имени с пациентом программы
+    return ProgramCatalog(programs, methods, specialists, patients, individuals, condition_mapping)
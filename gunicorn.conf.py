@@ -0,0 +1,60 @@
+"""Настройки gunicorn для продакшен-режима.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Приложение импортируется один раз в главном процессе (preload_app); импорт
+не загружает онтологию, поэтому порт открывается сразу. Онтология
+загружается и компилируется в главном процессе после открытия порта, до
+запуска рабочих процессов: они получают готовый каталог и матрицу признаков
+через copy-on-write, не разбирая онтологию заново. Запросы до окончания
+загрузки ждут в очереди сокета, в том числе /healthz: проверке живости
+нужна задержка на время загрузки (initialDelaySeconds или startupProbe).
+
+С REHAB_PRELOAD_ONTOLOGY=0 (или если загрузка в главном процессе не удалась)
+каждый рабочий процесс загружает онтологию сам, в фоне: /healthz отвечает
+сразу, /readyz до готовности возвращает 503, но память на каталог нужна в
+каждом процессе. С хранилищем REHAB_ONTOLOGY_STORE онтология открывается без
+разбора файла, и этот режим включен по умолчанию.
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('REHAB_WORKERS', multiprocessing.cpu_count()))
+# gthread: соединения keep-alive и медленные клиенты ждут в цикле событий
+# главного потока рабочего процесса и не занимают потоки-обработчики
+worker_class = os.environ.get('REHAB_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('REHAB_THREADS', 4))
+preload_app = True
+timeout = int(os.environ.get('REHAB_WORKER_TIMEOUT', 60))
+accesslog = '-'
+preload_ontology = os.environ.get(
+    'REHAB_PRELOAD_ONTOLOGY', '0' if os.environ.get('REHAB_ONTOLOGY_STORE') else '1'
+) == '1'
+
+
+def when_ready(server):
+    # Порт уже открыт; рабочие процессы запускаются после возврата из хука
+    if preload_ontology:
+        import app
+        # Наблюдение за файлом запускается только в рабочих процессах (post_fork)
+        app.warm_up(max_attempts=1, watch=False)
+
+
+def pre_fork(server, worker):
+    # Объекты, созданные при загрузке, переносятся в постоянное поколение:
+    # сборщик мусора не будет обходить их в рабочих процессах и не испортит
+    # общие страницы памяти записью в заголовки объектов
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Потоки главного процесса не переживают fork: наблюдение за файлом
+    # онтологии и фоновая загрузка запускаются в каждом рабочем процессе отдельно
+    import app
+    if app.ontology_manager.current is None:
+        app.start_warmup()
+    elif app.ONTOLOGY_WATCH:
+        app.ontology_manager.watch(app.ONTOLOGY_WATCH_INTERVAL)
@@ -0,0 +1,187 @@
+"""Правки программ и пациентов в загруженной онтологии.
+
+Функции меняют сущности в мире owlready2 и возвращают аргументы для
+RehabilitationSystem.updated: записи, которые нужно перечитать, и имена
+удаленных сущностей. Все значения проверяются до первого изменения онтологии.
+Вызываются через OntologyManager.edit, который сохраняет файл и подменяет снимок.
+"""
+
+import re
+
+from owlready2 import DataPropertyClass, FunctionalProperty, ObjectPropertyClass, Thing, destroy_entity
+
+from catalog import _patient_record, read_program
+
+# Поля JSON-тела правки: имя свойства онтологии -> тип значений
+# (int/str — значения данных, Thing — ссылки на сущности по имени)
+PROGRAM_FIELDS = {
+    'hasDuration': int,
+    'hasSessionCount': int,
+    'includesMethod': Thing,
+    'suitableFor': Thing,
+    'supervisedBy': Thing,
+    'hasTarget': str,
+}
+PATIENT_FIELDS = {
+    'hasCondition': str,
+    'hasSeverity': str,
+    'hasAgeGroup': str,
+    'hasMovementImpairment': str,
+    'hasTarget': str,
+    'treatedBy': Thing,
+}
+# Аннотации отображаемого имени
+ANNOTATION_FIELDS = ('comment', 'label')
+
+SUITABLE_FOR = ('suitableFor', 'подходитДля')
+NAME_PATTERN = re.compile(r'^[^\W\d][\w-]*$')
+
+
+class EntityNotFound(LookupError):
+    """Изменяемая сущность отсутствует в онтологии"""
+
+
+def _find_class(onto, *markers):
+    """Первый класс онтологии, в имени которого есть один из маркеров"""
+    for cls in onto.classes():
+        if any(marker in str(cls) for marker in markers):
+            return cls
+    raise ValueError(f'В онтологии нет класса {markers[-1]}')
+
+
+def _program_class(onto):
+    return _find_class(onto, 'Программа', 'Program')
+
+
+def _patient_class(onto):
+    return _find_class(onto, 'Пациент', 'Patient')
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _convert(onto, field, kind, value):
+    if kind is Thing:
+        entity = onto[str(value)] if isinstance(value, str) else None
+        if not isinstance(entity, Thing):
+            raise ValueError(f'{field}: неизвестная сущность {value!r}')
+        return entity
+    if kind is int:
+        if isinstance(value, bool):
+            raise ValueError(f'{field}: ожидается целое число, получено {value!r}')
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field}: ожидается целое число, получено {value!r}') from None
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise ValueError(f'{field}: ожидается строка, получено {value!r}')
+    return str(value)
+
+
+def _parse_fields(onto, payload, fields):
+    """Проверить тело правки: {имя свойства: значение или список значений}.
+
+    Возвращает список (свойство или имя аннотации, значения); свойства,
+    которых нет в онтологии, и неизвестные поля отклоняются.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('ожидается JSON-объект со свойствами')
+    parsed = []
+    for field, value in payload.items():
+        if field in ANNOTATION_FIELDS:
+            parsed.append((field, [_convert(onto, field, str, item) for item in _as_list(value) if item != '']))
+            continue
+        kind = fields.get(field)
+        if kind is None:
+            raise ValueError(f'Неизвестное поле: {field!r}')
+        prop = onto[field]
+        expected = ObjectPropertyClass if kind is Thing else DataPropertyClass
+        if not isinstance(prop, expected):
+            raise ValueError(f'В онтологии нет свойства {field!r}')
+        parsed.append((prop, [_convert(onto, field, kind, item) for item in _as_list(value)]))
+    return parsed
+
+
+def _apply_fields(entity, parsed):
+    for prop, values in parsed:
+        if isinstance(prop, str):
+            setattr(entity, prop, values)
+        elif FunctionalProperty in prop.is_a:
+            setattr(entity, prop.python_name, values[0] if values else None)
+        else:
+            setattr(entity, prop.python_name, values)
+
+
+def _individual(onto, name, cls, create):
+    """Сущность класса cls по имени; при create=True отсутствующая создается"""
+    if not isinstance(name, str) or not NAME_PATTERN.match(name):
+        raise ValueError(f'Некорректное имя сущности: {name!r}')
+    entity = onto[name]
+    if entity is None:
+        if not create:
+            raise EntityNotFound(f'Сущность {name!r} не найдена')
+        return None
+    if not isinstance(entity, cls):
+        raise ValueError(f'Сущность {name!r} не является экземпляром {cls.name}')
+    return entity
+
+
+def _linked_programs(onto, patient):
+    """Программы, у которых пациент указан в suitableFor"""
+    programs = []
+    for name in SUITABLE_FOR:
+        prop = onto[name]
+        if isinstance(prop, ObjectPropertyClass):
+            programs.extend(
+                program for program in onto.search(**{prop.python_name: patient})
+                if program not in programs
+            )
+    return programs
+
+
+def put_program(onto, system, name, payload):
+    """Создать программу или изменить перечисленные в payload свойства"""
+    cls = _program_class(onto)
+    program = _individual(onto, name, cls, create=True)
+    parsed = _parse_fields(onto, payload, PROGRAM_FIELDS)
+    if program is None:
+        program = cls(name, namespace=onto)
+    _apply_fields(program, parsed)
+    return {'programs': [read_program(program, system.backend)]}
+
+
+def delete_program(onto, system, name):
+    """Удалить программу вместе со всеми ее связями"""
+    program = _individual(onto, name, _program_class(onto), create=False)
+    destroy_entity(program)
+    return {'removed_programs': [name]}
+
+
+def put_patient(onto, system, name, payload):
+    """Создать пациента (архетип) или изменить перечисленные в payload свойства.
+
+    Программы, ссылающиеся на пациента, перечитываются: в их записях хранятся
+    отображаемые имена пациентов.
+    """
+    cls = _patient_class(onto)
+    patient = _individual(onto, name, cls, create=True)
+    parsed = _parse_fields(onto, payload, PATIENT_FIELDS)
+    if patient is None:
+        patient = cls(name, namespace=onto)
+    _apply_fields(patient, parsed)
+    return {
+        'patients': [_patient_record(patient, system.condition_mapping)],
+        'programs': [read_program(program, system.backend) for program in _linked_programs(onto, patient)],
+    }
+
+
+def delete_patient(onto, system, name):
+    """Удалить пациента; ссылки на него из программ удаляются вместе с ним"""
+    patient = _individual(onto, name, _patient_class(onto), create=False)
+    programs = _linked_programs(onto, patient)
+    destroy_entity(patient)
+    return {
+        'removed_patients': [name],
+        'programs': [read_program(program, system.backend) for program in programs],
+    }
@@ -0,0 +1,363 @@
+"""Загрузка онтологии и горячая подмена скомпилированных снимков.
+
+Каждая версия онтологии загружается в собственный owlready2.World и
+компилируется в фоне. Готовый снимок подменяется одной операцией
+присваивания: запросы, уже получившие старый снимок, дорабатывают на нем.
+
+Правки сохраняются в RDF/XML: для онтологии OWL/XML (.owx) — в соседний файл
+.owl (edited_path), исходный файл не меняется. Загружается более новый из двух
+(source_path). Правки нескольких процессов упорядочиваются блокировкой файла.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ONTOLOGY_PATH = os.path.join('ontology', 'rehabilitation.owx')
+
+
+def file_digest(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def edited_path(path):
+    """Файл, в который сохраняются правки онтологии path.
+
+    owlready2 не умеет записывать OWL/XML, поэтому правки онтологии .owx
+    сохраняются рядом в RDF/XML с расширением .owl.
+    """
+    stem, extension = os.path.splitext(path)
+    return stem + '.owl' if extension.lower() == '.owx' else path
+
+
+def source_path(path):
+    """Файл, из которого загружается онтология path: сохраненные правки, если
+    они не старше исходного файла, иначе сам исходный файл"""
+    edited = edited_path(path)
+    try:
+        if edited != path and os.path.getmtime(edited) >= os.path.getmtime(path):
+            return edited
+    except OSError:
+        if os.path.exists(edited):
+            return edited
+    return path
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Межпроцессная блокировка правок онтологии path (flock на файле path.lock)"""
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_ontology(path=ONTOLOGY_PATH, store_path=None, digest=None):
+    """Загрузить онтологию в отдельный мир owlready2.
+
+    Если задан store_path, онтология хранится в постоянном SQLite-хранилище
+    owlready2: при первом запуске оно строится из .owx, а дальше открывается
+    без разбора XML, пока хэш исходного файла не изменится.
+    """
+    # owlready2 импортируется при первой загрузке: импорт приложения его не ждет
+    from owlready2 import World
+
+    if not store_path:
+        world = World()
+        return world.get_ontology(path).load()
+
+    digest = digest or file_digest(path)
+    meta = _read_store_meta(store_path)
+    if not (meta and meta.get('source_hash') == digest and os.path.exists(store_path)):
+        meta = _build_store(path, store_path, digest)
+
+    # Хранилище открывается только на чтение и может использоваться несколькими процессами
+    world = World(filename=store_path, exclusive=False, read_only=True)
+    return world.get_ontology(meta['base_iri']).load()
+
+
+def _store_meta_path(store_path):
+    return store_path + '.json'
+
+
+def _read_store_meta(store_path):
+    try:
+        with open(_store_meta_path(store_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _build_store(path, store_path, digest):
+    """Разобрать .owx в новый файл хранилища и атомарно подменить старый"""
+    from owlready2 import World
+
+    logger.info("Построение хранилища онтологии %s...", store_path)
+    tmp_path = f'{store_path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    world = World(filename=tmp_path)
+    onto = world.get_ontology(path).load()
+    meta = {
+        'source': path,
+        'source_hash': digest,
+        'source_mtime': os.path.getmtime(path),
+        'base_iri': onto.base_iri,
+        'built_at': time.time(),
+    }
+    world.save()
+    world.close()
+
+    os.replace(tmp_path, store_path)
+    tmp_meta = f'{_store_meta_path(store_path)}.{os.getpid()}.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_meta, _store_meta_path(store_path))
+    return meta
+
+
+def save_ontology(onto, path):
+    """Атомарно записать онтологию в файл RDF/XML и вернуть хэш нового содержимого.
+
+    RDF/XML читают и owlready2, и Protégé; путь для правок дает edited_path.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    onto.save(file=tmp_path, format='rdfxml')
+    os.replace(tmp_path, path)
+    return file_digest(path)
+
+
+def release_ontology(onto):
+    """Освободить мир owlready2 онтологии, которая больше не используется.
+
+    Мир закрывается (SQLite-соединение держит ссылки на мир через
+    зарегистрированные SPARQL-функции, и сборщик мусора не разрывает этот цикл),
+    а его сущности убираются из общего кэша owlready2. Подготовленные
+    SPARQL-запросы хранятся в общем кэше класса World вместе с миром, поэтому
+    этот кэш сбрасывается целиком. Скомпилированный каталог остается рабочим:
+    он не обращается к онтологии.
+    """
+    from owlready2 import World
+
+    world = onto.world
+    world.close()
+    World._prepare_sparql.cache_clear()
+
+
+class OntologyEditError(RuntimeError):
+    """Правка онтологии невозможна в текущем состоянии"""
+
+
+class OntologySnapshot:
+    """Загруженная версия онтологии вместе с построенной над ней системой"""
+    __slots__ = ('number', 'digest', 'loaded_at', 'onto', 'system')
+
+    def __init__(self, number, digest, onto, system):
+        self.number = number
+        self.digest = digest
+        self.loaded_at = time.time()
+        self.onto = onto
+        self.system = system
+
+    @property
+    def version(self):
+        """Идентификатор версии: порядковый номер и начало хэша файла"""
+        return f'{self.number}-{(self.digest or "none")[:12]}'
+
+    def info(self):
+        return {
+            'version': self.version,
+            'number': self.number,
+            'hash': self.digest,
+            'loaded_at': self.loaded_at,
+            'programs': len(self.system.catalog),
+        }
+
+
+class OntologyManager:
+    """Хранит текущий снимок онтологии и умеет перезагружать его без простоя"""
+
+    def __init__(self, path, build_system, store_path=None):
+        self.path = path
+        self.store_path = store_path
+        self.build_system = build_system
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watch_thread = None
+        self._stop = threading.Event()
+        self._number = 0
+        self.current = None
+        self.closed = False
+
+    def load_initial(self):
+        """Первичная загрузка; при ошибке система работает с пустым каталогом"""
+        snapshot = self._build_snapshot()
+        if snapshot is None:
+            snapshot = OntologySnapshot(0, None, None, self.build_system(None))
+        self.current = snapshot
+        return snapshot
+
+    def load_if_missing(self):
+        """Загрузить онтологию, если она еще не загружена; вернуть текущий снимок
+        (None, если загрузка не удалась). Одновременные вызовы загружают ее один раз"""
+        with self._reload_lock:
+            if self.current is None and not self.closed:
+                snapshot = self._build_snapshot()
+                if snapshot is not None:
+                    self._replace(None, snapshot)
+            return self.current
+
+    def _build_snapshot(self):
+        try:
+            path = source_path(self.path)
+            digest = file_digest(path)
+            onto = load_ontology(path, self.store_path, digest)
+            logger.info("✅ Онтология загружена успешно!")
+            system = self.build_system(onto)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error("❌ Ошибка загрузки онтологии: %s", e)
+            return None
+
+        self.last_error = None
+        self._number += 1
+        snapshot = OntologySnapshot(self._number, digest, onto, system)
+        system.version = snapshot.version
+        return snapshot
+
+    def reload(self, force=False):
+        """Перезагрузить онтологию, если файл изменился; вернуть текущий снимок"""
+        with self._reload_lock:
+            current = self.current
+            if self.closed:
+                return current
+            if not force and current is not None and current.digest:
+                try:
+                    if file_digest(source_path(self.path)) == current.digest:
+                        return current
+                except OSError as e:
+                    self.last_error = str(e)
+                    logger.error("❌ Ошибка чтения онтологии: %s", e)
+                    return current
+
+            snapshot = self._build_snapshot()
+            if snapshot is None:
+                return current
+            self._replace(current, snapshot)
+            return snapshot
+
+    def _replace(self, current, snapshot):
+        self.current = snapshot
+        if current is not None and current.onto is not None:
+            release_ontology(current.onto)
+        logger.info("Онтология обновлена до версии %s", snapshot.version)
+
+    def edit(self, change):
+        """Внести правку в загруженную онтологию без полной перезагрузки.
+
+        change(onto, system) меняет сущности в мире owlready2 и возвращает
+        аргументы для system.updated. Онтология сохраняется в файл (edited_path),
+        а снимок с тем же миром и обновленной системой подменяет текущий. Хэш
+        снимка равен хэшу сохраненного файла, поэтому наблюдение за файлом не
+        запускает полную перезагрузку в этом процессе.
+
+        Правки всех процессов выполняются под блокировкой файла; если файл
+        успел изменить другой процесс, онтология сначала перечитывается, и
+        правка применяется к его версии.
+        """
+        with self._reload_lock, file_lock(self.path):
+            current = self.current
+            if self.closed:
+                raise OntologyEditError('Онтология выгружена')
+            if current is None or current.onto is None:
+                raise OntologyEditError('Онтология не загружена')
+            if self.store_path:
+                raise OntologyEditError('Онтология открыта из хранилища только для чтения (REHAB_ONTOLOGY_STORE)')
+
+            try:
+                changed = file_digest(source_path(self.path)) != current.digest
+            except OSError:
+                changed = False
+            if changed:
+                snapshot = self._build_snapshot()
+                if snapshot is None:
+                    raise OntologyEditError(f'Не удалось перечитать измененную онтологию: {self.last_error}')
+                self._replace(current, snapshot)
+                current = snapshot
+
+            changes = change(current.onto, current.system)
+            system = current.system.updated(**changes)
+            digest = save_ontology(current.onto, edited_path(self.path))
+
+            self._number += 1
+            snapshot = OntologySnapshot(self._number, digest, current.onto, system)
+            system.version = snapshot.version
+            self.current = snapshot
+            logger.info("Онтология изменена, версия %s", snapshot.version)
+            return snapshot
+
+    def reload_in_background(self, force=False):
+        """Запустить перезагрузку в фоновом потоке"""
+        thread = threading.Thread(target=self.reload, kwargs={'force': force},
+                                  name='ontology-reload', daemon=True)
+        self._reload_thread = thread
+        thread.start()
+        return thread
+
+    def watch(self, interval=2.0):
+        """Следить за изменением файла онтологии и перезагружать его.
+
+        После fork поток наблюдения в дочернем процессе не существует, поэтому
+        повторный вызов в рабочем процессе запускает его заново.
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return self._watch_thread
+
+        def poll():
+            last_stat = None
+            while not self._stop.is_set():
+                try:
+                    path = source_path(self.path)
+                    stat = os.stat(path)
+                    signature = (path, stat.st_mtime_ns, stat.st_size)
+                    if last_stat is not None and signature != last_stat:
+                        self.reload()
+                    last_stat = signature
+                except OSError:
+                    pass
+                self._stop.wait(interval)
+
+        self._watch_thread = threading.Thread(target=poll, name='ontology-watch', daemon=True)
+        self._watch_thread.start()
+        return self._watch_thread
+
+    def close(self):
+        """Остановить наблюдение за файлом и освободить мир owlready2.
+
+        Запросы, уже получившие систему, дорабатывают на скомпилированном
+        каталоге; перезагрузка и правки закрытого менеджера не выполняются.
+        """
+        with self._reload_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._stop.set()
+            current = self.current
+            if current is not None and current.onto is not None:
+                release_ontology(current.onto)
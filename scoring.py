@@ -0,0 +1,269 @@
+"""Векторизованная оценка программ реабилитации.
+
+Каждая программа кодируется один раз вектором признаков (совпадения методов
+по ключевым словам, совпадения целей), а запрос пациента превращается в вектор
+весов. Баллы всех программ вычисляются одним матрично-векторным произведением
+по тем же правилам, что и раньше; совпадение с исходным подбором проверяет
+benchmarks/check_equivalence.py.
+
+Уровень ограничения движения программы (suitableMovementImpairment) в балл не
+входит: исходный подбор читал его по ключу с опечаткой и бонус за уровень
+никогда не начислялся.
+"""
+
+import copy
+import heapq
+
+import numpy as np
+
+BASE_SCORE = 50
+MAX_SCORE = 100
+
+GOAL_METHOD_MAP = {
+    'walking': ['лфк', 'exercise', 'механотерапия', 'робот', 'ходьба'],
+    'mobility': ['физиотерапия', 'physiotherapy', 'электро', 'магнит', 'подвижность'],
+    'pain_relief': ['физиотерапия', 'массаж', 'massage', 'обезболивание'],
+    'coordination': ['лфк', 'эрготерапия', 'occupational', 'координация'],
+    'psychological': ['психологическая', 'психология', 'psychological', 'кпт', 'психотерапия'],
+    'daily_activities': ['эрготерапия', 'occupational', 'бытовые', 'повседневные']
+}
+
+SEVERITY_METHOD_BONUS = {
+    'тяжелая': ('робот', 15),
+    'легкая': ('лфк', 10)
+}
+
+IMPAIRMENT_METHOD_MAP = {
+    'severe': ['роботизированная терапия', 'гидротерапия', 'массаж'],
+    'paralysis': ['роботизированная терапия', 'электрофорез', 'магнитотерапия'],
+    'moderate': ['лфк', 'эрготерапия', 'массаж'],
+    'mild': ['лфк', 'физиотерапия', 'упражнения'],
+    'none': ['упражнения', 'профилактика']
+}
+
+TARGET_METHOD_MAP = {
+    'walking': ['роботизированная терапия', 'лфк', 'ходьба'],
+    'balance': ['упражнения на баланс', 'лфк', 'физиотерапия'],
+    'strength': ['силовые упражнения', 'лфк', 'тренажеры'],
+    'flexibility': ['растяжка', 'йога', 'пилатес'],
+    'coordination': ['эрготерапия', 'упражнения на координацию', 'лфк'],
+    'pain_reduction': ['массаж', 'физиотерапия', 'гидротерапия']
+}
+
+GOAL_BONUS = 10
+MOVEMENT_METHOD_BONUS = 5
+TARGET_BONUS = 10
+TARGET_METHOD_BONUS = 5
+
+# Бонус за соответствие конкретному пациенту онтологии (считается отдельно,
+# вне матрицы признаков): пациент подходит программе, совпал уровень движения,
+# совпала цель
+PATIENT_MATCH_BONUS = 5
+PATIENT_MOVEMENT_BONUS = 5
+PATIENT_TARGET_BONUS = 5
+PATIENT_SPECIFIC_MAX = PATIENT_MATCH_BONUS + PATIENT_MOVEMENT_BONUS + PATIENT_TARGET_BONUS
+
+
+def _methods_contain(methods_lower, keywords):
+    """Есть ли среди методов программы хотя бы одно ключевое слово"""
+    return any(keyword in method for keyword in keywords for method in methods_lower)
+
+
+def target_text_matches(patient_target, program_targets_lower, target_translation):
+    """Совпадает ли цель пациента с одной из целей программы"""
+    patient_target_lower = patient_target.lower()
+    patient_target_translated = target_translation.get(patient_target, patient_target).lower()
+    words = patient_target_lower.split('_')
+    for program_target in program_targets_lower:
+        if (patient_target_lower in program_target or
+                patient_target_translated in program_target or
+                any(word in program_target for word in words)):
+            return True
+    return False
+
+
+class ScoringEngine:
+    """Матрица признаков программ и построение весов по данным пациента"""
+
+    def __init__(self, programs, target_translation):
+        self.target_translation = target_translation
+        self.columns = {}
+        self._program_targets, self.features = self._encode(programs)
+
+    def _encode(self, programs):
+        """Цели программ (в нижнем регистре) и матрица признаков программы x столбцы"""
+        program_targets = [tuple(t.lower() for t in program.target) for program in programs]
+        methods_lower = [[str(m).lower() for m in program.methods] for program in programs]
+
+        columns = {}
+        features = []
+
+        def add_column(key, values):
+            columns[key] = len(features)
+            features.append(values)
+
+        add_column('base', [1] * len(programs))
+        for goal, keywords in GOAL_METHOD_MAP.items():
+            add_column(('goal', goal), [_methods_contain(m, keywords) for m in methods_lower])
+        for severity, (keyword, _) in SEVERITY_METHOD_BONUS.items():
+            add_column(('severity', severity), [_methods_contain(m, [keyword]) for m in methods_lower])
+        for impairment, keywords in IMPAIRMENT_METHOD_MAP.items():
+            add_column(('impairment', impairment), [_methods_contain(m, keywords) for m in methods_lower])
+        for target, keywords in TARGET_METHOD_MAP.items():
+            add_column(('target_method', target), [_methods_contain(m, keywords) for m in methods_lower])
+        for target in sorted(set(self.target_translation) | set(TARGET_METHOD_MAP)):
+            add_column(('target', target), self._target_column(target, program_targets))
+
+        self.columns = columns
+        return program_targets, np.array(features, dtype=np.int64).reshape(len(features), len(programs)).T
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def _target_column(self, target, program_targets=None):
+        if program_targets is None:
+            program_targets = self._program_targets
+        return [
+            bool(targets) and target_text_matches(target, targets, self.target_translation)
+            for targets in program_targets
+        ]
+
+    def updated(self, programs, changed_ids=(), removed_ids=()):
+        """Новый движок после правки каталога: строки удаленных программ
+        (номера в старом каталоге) убираются, строки измененных и новых
+        (номера в новом каталоге programs) кодируются заново. Текущий движок
+        не меняется.
+        """
+        engine = copy.copy(self)
+        features = np.delete(self.features, removed_ids, axis=0) if len(removed_ids) else self.features.copy()
+        removed = set(removed_ids)
+        program_targets = [targets for program_id, targets in enumerate(self._program_targets)
+                           if program_id not in removed]
+
+        added = len(programs) - features.shape[0]
+        if added > 0:
+            features = np.vstack([features, np.zeros((added, features.shape[1]), dtype=features.dtype)])
+            program_targets.extend([()] * added)
+        if changed_ids:
+            changed_ids = list(changed_ids)
+            targets, rows = self._encode([programs[program_id] for program_id in changed_ids])
+            features[changed_ids] = rows
+            for program_id, program_target in zip(changed_ids, targets):
+                program_targets[program_id] = program_target
+
+        engine.features = features
+        engine._program_targets = program_targets
+        return engine
+
+    def weights(self, patient_data):
+        """Вектор весов признаков для запроса пациента"""
+        weights = np.zeros(self.features.shape[1], dtype=np.int64)
+        extra = None
+        weights[self.columns['base']] = BASE_SCORE
+
+        for goal in patient_data.get('goals', []):
+            column = self.columns.get(('goal', goal))
+            if column is not None:
+                weights[column] += GOAL_BONUS
+
+        severity = patient_data.get('severity', '')
+        if severity in SEVERITY_METHOD_BONUS:
+            weights[self.columns[('severity', severity)]] = SEVERITY_METHOD_BONUS[severity][1]
+
+        movement_impairment = patient_data.get('movement_impairment', '').lower()
+        column = self.columns.get(('impairment', movement_impairment))
+        if column is not None:
+            weights[column] = MOVEMENT_METHOD_BONUS
+
+        target = patient_data.get('target', '')
+        if target:
+            column = self.columns.get(('target', target))
+            if column is not None:
+                weights[column] = TARGET_BONUS
+            else:
+                extra = np.array(self._target_column(target), dtype=np.int64) * TARGET_BONUS
+            column = self.columns.get(('target_method', target))
+            if column is not None:
+                weights[column] = TARGET_METHOD_BONUS
+
+        return weights, extra
+
+    def score(self, patient_data):
+        """Баллы всех программ (без ограничения сверху) для одного пациента"""
+        weights, extra = self.weights(patient_data)
+        scores = self.features @ weights
+        if extra is not None:
+            scores += extra
+        return scores
+
+    def explain(self, patient_data, program_id):
+        """Разложить балл программы из матрицы признаков по составляющим"""
+        weights, extra = self.weights(patient_data)
+        contributions = self.features[program_id] * weights
+
+        explanation = {
+            'base': 0,
+            'goals': {},
+            'severity': 0,
+            'movement_method': 0,
+            'target': int(extra[program_id]) if extra is not None else 0,
+            'target_method': 0,
+        }
+        for key, column in self.columns.items():
+            value = int(contributions[column])
+            if key == 'base':
+                explanation['base'] = value
+            elif key[0] == 'goal':
+                if weights[column]:
+                    explanation['goals'][key[1]] = value
+            else:
+                name = {'severity': 'severity', 'impairment': 'movement_method',
+                        'target': 'target', 'target_method': 'target_method'}[key[0]]
+                explanation[name] += value
+        return explanation
+
+    def score_batch(self, patients):
+        """Баллы всех программ для группы пациентов: матрица программы x пациенты"""
+        if not patients:
+            return np.zeros((len(self), 0), dtype=np.int64)
+        weights, extras = zip(*(self.weights(patient_data) for patient_data in patients))
+        scores = self.features @ np.stack(weights, axis=1)
+        for i, extra in enumerate(extras):
+            if extra is not None:
+                scores[:, i] += extra
+        return scores
+
+
+def top_k(base_scores, extra_score, k, extra_max=PATIENT_SPECIFIC_MAX, cap=MAX_SCORE):
+    """Отобрать k лучших кандидатов, не вычисляя дорогую добавку для безнадежных.
+
+    base_scores — баллы из матрицы признаков, extra_score(position) — дорогая
+    добавка (не больше extra_max). Кандидаты просматриваются по убыванию верхней
+    оценки min(base + extra_max, cap); как только она не может превзойти k-й
+    найденный балл, просмотр прекращается. Результат — список пар
+    (позиция, балл) в том же порядке, что дала бы устойчивая сортировка всех
+    кандидатов по убыванию балла.
+    """
+    if k <= 0 or len(base_scores) == 0:
+        return []
+
+    upper = np.minimum(base_scores + extra_max, cap)
+    # Устойчивая сортировка: при равной верхней оценке раньше идет меньшая позиция
+    visit_order = np.argsort(-upper, kind='stable')
+
+    heap = []  # (балл, -позиция): на вершине худший из отобранных
+    for position in visit_order.tolist():
+        if len(heap) == k:
+            worst_score, worst_neg_position = heap[0]
+            bound = int(upper[position])
+            if bound < worst_score or (bound == worst_score and -position < worst_neg_position):
+                break
+
+        score = min(int(base_scores[position]) + extra_score(position), cap)
+        item = (score, -position)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    return [(-neg_position, score) for score, neg_position in sorted(heap, reverse=True)]
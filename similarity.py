@@ -0,0 +1,259 @@
+"""Поиск похожих пациентов онтологии (архетипов) по векторам профиля.
+
+Каждый пациент онтологии кодируется один раз строкой матрицы признаков:
+диагноз, степень тяжести, возрастная группа, уровень ограничения движения,
+цели и характер боли. Анкета пациента кодируется тем же способом, и близость
+ко всем архетипам вычисляется одним матрично-векторным произведением
+(косинусная близость), после чего отбираются k ближайших.
+
+Диагноз и цели — категории (по столбцу на значение), степень тяжести, возраст,
+движение и боль — порядковые шкалы: соседние уровни считаются частично
+похожими. Вес блока задает его вклад в близость; блок, не заполненный у
+пациента или в анкете, в близость не входит, но снижает ее общую величину.
+"""
+
+import bisect
+import copy
+import math
+
+import numpy as np
+
+SEVERITY_LEVELS = {'легкая': 0, 'средняя': 1, 'тяжелая': 2}
+AGE_LEVELS = {'детский': 0, 'молодой': 1, 'взрослый': 2, 'взрослая': 2, 'пожилой': 3}
+# Уровень движения в онтологии записан по-русски, в анкете — кодом формы
+MOVEMENT_LEVELS = {
+    'нет ограничений': 0, 'none': 0,
+    'легкая': 1, 'mild': 1,
+    'средняя': 2, 'medium': 2, 'moderate': 2,
+    'тяжелая': 3, 'severe': 3, 'paralysis': 3,
+}
+PAIN_LEVELS = {'отсутствует': 0, 'хронический': 1, 'острый': 2}
+
+BLOCK_WEIGHTS = {
+    'diagnosis': 3.0,
+    'severity': 1.0,
+    'age_group': 0.5,
+    'movement': 1.5,
+    'goals': 1.0,
+    'pain_level': 0.5,
+}
+# Близость соседних уровней порядковой шкалы
+NEIGHBOUR_SIMILARITY = 0.5
+
+DEFAULT_K = 5
+
+
+def _ordinal_profiles(scale):
+    """Единичные векторы уровней шкалы: на своем уровне вес 1, на соседних —
+    NEIGHBOUR_SIMILARITY"""
+    size = max(scale.values()) + 1
+    profiles = np.zeros((size, size), dtype=np.float32)
+    for level in range(size):
+        profiles[level, level] = 1
+        if level > 0:
+            profiles[level, level - 1] = NEIGHBOUR_SIMILARITY
+        if level < size - 1:
+            profiles[level, level + 1] = NEIGHBOUR_SIMILARITY
+    return profiles / np.linalg.norm(profiles, axis=1, keepdims=True)
+
+
+def _vocabularies(patients, condition_mapping, target_translation, goal_translation):
+    """Значения категорий (диагнозы, цели) -> номер столбца в блоке, в порядке появления"""
+    diagnoses = list(condition_mapping)
+    goals = [text.lower() for text in (*target_translation.values(), *goal_translation.values())]
+    for patient in patients:
+        diagnoses.extend((patient.condition, *patient.diagnoses))
+        goals.extend(patient.targets)
+    return (
+        {value: i for i, value in enumerate(dict.fromkeys(filter(None, diagnoses)))},
+        {value: i for i, value in enumerate(dict.fromkeys(filter(None, goals)))},
+    )
+
+
+def _patient_values(patient):
+    """Значения блоков профиля пациента онтологии"""
+    return {
+        'diagnosis': {patient.condition, *patient.diagnoses},
+        'goals': set(patient.targets),
+        'severity': patient.severity,
+        'age_group': patient.age_group,
+        'movement': patient.movement,
+        'pain_level': patient.pain_level,
+    }
+
+
+class ArchetypeIndex:
+    """Матрица профилей пациентов онтологии и поиск ближайших к анкете"""
+
+    def __init__(self, patients, programs, condition_mapping, target_translation, goal_translation):
+        self.patients = tuple(patients)
+        self.condition_mapping = condition_mapping
+        self.target_translation = target_translation
+        self.goal_translation = goal_translation
+        self.diagnoses, self.goals = _vocabularies(
+            self.patients, condition_mapping, target_translation, goal_translation
+        )
+
+        self._ordinals = {
+            'severity': (SEVERITY_LEVELS, _ordinal_profiles(SEVERITY_LEVELS)),
+            'age_group': (AGE_LEVELS, _ordinal_profiles(AGE_LEVELS)),
+            'movement': (MOVEMENT_LEVELS, _ordinal_profiles(MOVEMENT_LEVELS)),
+            'pain_level': (PAIN_LEVELS, _ordinal_profiles(PAIN_LEVELS)),
+        }
+        sizes = {
+            'diagnosis': len(self.diagnoses),
+            'goals': len(self.goals),
+            **{block: len(profiles) for block, (_, profiles) in self._ordinals.items()},
+        }
+        self._slices = {}
+        offset = 0
+        for block in BLOCK_WEIGHTS:
+            self._slices[block] = slice(offset, offset + sizes[block])
+            offset += sizes[block]
+        self.dimension = offset
+        # Столбцы значений категорий в строке признаков
+        self._columns = {
+            'diagnosis': {value: self._slices['diagnosis'].start + i for value, i in self.diagnoses.items()},
+            'goals': {value: self._slices['goals'].start + i for value, i in self.goals.items()},
+        }
+
+        self.features = np.zeros((len(self.patients), self.dimension), dtype=np.float32)
+        for row, patient in enumerate(self.patients):
+            self._encode(self.features[row], _patient_values(patient))
+
+        # Программы, в которых пациент указан как подходящий, в порядке каталога
+        positions = {patient.name: row for row, patient in enumerate(self.patients)}
+        linked = [[] for _ in self.patients]
+        for program_id, program in enumerate(programs):
+            for name in program.suitable_patient_names:
+                if name in positions:
+                    linked[positions[name]].append(program_id)
+        self.programs_by_patient = tuple(tuple(ids) for ids in linked)
+
+    def __len__(self):
+        return len(self.patients)
+
+    def updated(self, patients, programs, changed_patients=(), changed_program_ids=(), removed_program_ids=()):
+        """Новый индекс после правки каталога. Текущий индекс не меняется.
+
+        patients и programs — записи нового каталога, changed_patients — имена
+        новых и измененных пациентов (удаленные просто отсутствуют в patients),
+        changed_program_ids — номера новых и измененных программ в новом
+        каталоге, removed_program_ids — удаленных в текущем. Заново кодируются
+        только строки измененных пациентов и списки программ затронутых
+        пациентов; если правка меняет набор диагнозов или целей, столбцы
+        категорий другие, и индекс строится заново.
+        """
+        patients = tuple(patients)
+        diagnoses, goals = _vocabularies(patients, self.condition_mapping, self.target_translation,
+                                         self.goal_translation)
+        if diagnoses.keys() != self.diagnoses.keys() or goals.keys() != self.goals.keys():
+            return ArchetypeIndex(patients, programs, self.condition_mapping, self.target_translation,
+                                  self.goal_translation)
+
+        index = copy.copy(self)
+        index.patients = patients
+        old_rows = {patient.name: row for row, patient in enumerate(self.patients)}
+        changed = set(changed_patients)
+
+        # Строки неизмененных пациентов переносятся, остальные кодируются заново
+        index.features = np.zeros((len(patients), self.dimension), dtype=np.float32)
+        kept = [(row, old_rows[patient.name]) for row, patient in enumerate(patients)
+                if patient.name in old_rows and patient.name not in changed]
+        if kept:
+            rows, source_rows = zip(*kept)
+            index.features[list(rows)] = self.features[list(source_rows)]
+        for row, patient in enumerate(patients):
+            if patient.name not in old_rows or patient.name in changed:
+                self._encode(index.features[row], _patient_values(patient))
+
+        # Номера программ сдвигаются за удаленными; ссылки измененных программ
+        # и ссылки на новых пациентов собираются заново
+        removed_ids = sorted(removed_program_ids)
+        removed = frozenset(removed_ids)
+        changed_ids = frozenset(changed_program_ids)
+        linked = []
+        for patient in patients:
+            row = old_rows.get(patient.name)
+            ids = self.programs_by_patient[row] if row is not None else ()
+            if removed or not changed_ids.isdisjoint(ids):
+                ids = [program_id - bisect.bisect_left(removed_ids, program_id)
+                       for program_id in ids if program_id not in removed]
+                ids = tuple(program_id for program_id in ids if program_id not in changed_ids)
+            linked.append(ids)
+
+        positions = {patient.name: row for row, patient in enumerate(patients)}
+        new_names = {patient.name for patient in patients if patient.name not in old_rows}
+        additions = {}
+        for program_id in (range(len(programs)) if new_names else sorted(changed_ids)):
+            for name in programs[program_id].suitable_patient_names:
+                row = positions.get(name)
+                if row is not None and (program_id in changed_ids or name in new_names):
+                    additions.setdefault(row, set()).add(program_id)
+        for row, ids in additions.items():
+            linked[row] = tuple(sorted({*linked[row], *ids}))
+        index.programs_by_patient = tuple(linked)
+        return index
+
+    def _encode(self, row, values):
+        """Заполнить строку признаков единичной длины: квадрат нормы каждого
+        заполненного блока пропорционален его весу"""
+        categories = []
+        levels = []
+        total = 0.0
+        for block, columns in self._columns.items():
+            found = [columns[value] for value in values[block] if value in columns]
+            if found:
+                categories.append((block, found))
+                total += BLOCK_WEIGHTS[block]
+        for block, (scale, profiles) in self._ordinals.items():
+            level = scale.get(values[block])
+            if level is not None:
+                levels.append((block, profiles[level]))
+                total += BLOCK_WEIGHTS[block]
+        if not total:
+            return
+        for block, found in categories:
+            row[found] = math.sqrt(BLOCK_WEIGHTS[block] / total / len(found))
+        for block, profile in levels:
+            row[self._slices[block]] = profile * math.sqrt(BLOCK_WEIGHTS[block] / total)
+
+    def encode(self, patient_data, row=None):
+        """Вектор признаков анкеты (в переданную строку или новый)"""
+        if row is None:
+            row = np.zeros(self.dimension, dtype=np.float32)
+        target = patient_data.get('target', '')
+        goals = {self.goal_translation.get(goal, goal).lower() for goal in patient_data.get('goals', [])}
+        if target:
+            goals.add(self.target_translation.get(target, target).lower())
+        self._encode(row, {
+            'diagnosis': {patient_data['diagnosis'].lower()},
+            'goals': goals,
+            'severity': patient_data.get('severity', '').lower(),
+            'age_group': patient_data.get('age_group', '').lower(),
+            'movement': patient_data.get('movement_impairment', '').lower(),
+            'pain_level': patient_data.get('pain_level', '').lower(),
+        })
+        return row
+
+    def nearest(self, patient_data, k=DEFAULT_K):
+        """k ближайших архетипов: список (номер пациента, близость 0..1) по убыванию близости"""
+        return self.nearest_batch([patient_data], k)[0]
+
+    def nearest_batch(self, patients_data, k=DEFAULT_K):
+        """nearest для группы анкет: близости всех пар считаются одним произведением матриц"""
+        queries = np.zeros((len(patients_data), self.dimension), dtype=np.float32)
+        for row, patient_data in enumerate(patients_data):
+            self.encode(patient_data, queries[row])
+        if not len(self.patients):
+            return [[] for _ in patients_data]
+
+        similarity = np.minimum(queries @ self.features.T, 1)
+        k = min(max(1, k), len(self.patients))
+        results = []
+        for scores in similarity:
+            top = np.argpartition(-scores, k - 1)[:k]
+            # При равной близости порядок — как в каталоге
+            top = top[np.lexsort((top, -scores[top]))]
+            results.append([(int(row), float(scores[row])) for row in top])
+        return results
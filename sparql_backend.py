@@ -0,0 +1,289 @@
+"""Чтение онтологии подготовленными SPARQL-запросами owlready2.
+
+Альтернатива обходу сущностей в catalog: соединения программ с методами,
+специалистами и пациентами выполняет движок SPARQL над хранилищем, а Python
+только раскладывает строки результата по записям каталога. Запросы готовятся
+один раз на мир owlready2 (World.prepare_sparql).
+
+Выбор способа: REHAB_RETRIEVAL_BACKEND=sparql (по умолчанию python).
+"""
+
+import logging
+
+from catalog import (NOT_SPECIFIED, MethodRecord, PatientRecord, ProgramRecord,
+                     display_name_from)
+
+logger = logging.getLogger(__name__)
+
+PREFIXES = """
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+"""
+
+PROGRAM_CLASS_FILTER = 'FILTER(CONTAINS(STR(?cls), "Program") || CONTAINS(STR(?cls), "Программа"))'
+PATIENT_CLASS_FILTER = 'FILTER(CONTAINS(STR(?cls), "Patient") || CONTAINS(STR(?cls), "Пациент"))'
+
+# Все экземпляры классов программ
+ALL_PROGRAMS_QUERY = PREFIXES + f"""
+SELECT ?program WHERE {{
+    ?cls a owl:Class .
+    {PROGRAM_CLASS_FILTER}
+    ?program a ?cls .
+}}
+"""
+
+# Значения одного свойства у всех программ. Свойство передается параметром:
+# с известным предикатом выборка идет по индексу (субъект, предикат), и значения
+# приходят в порядке хранилища. Так же их читает атрибут owlready2 у сущности,
+# загруженной из файла; списки, присвоенные в этом процессе (правки через
+# ontology_edit), атрибут возвращает в порядке присваивания, до перезагрузки
+ALL_PROGRAMS_PROPERTY_QUERY = PREFIXES + f"""
+SELECT ?program ?value WHERE {{
+    ?cls a owl:Class .
+    {PROGRAM_CLASS_FILTER}
+    ?program a ?cls .
+    ?program ??1 ?value .
+}}
+"""
+
+# Значения одного свойства у сущностей, на которые ссылаются программы
+PROGRAM_RELATED_PROPERTY_QUERY = PREFIXES + f"""
+SELECT DISTINCT ?entity ?value WHERE {{
+    ?cls a owl:Class .
+    {PROGRAM_CLASS_FILTER}
+    ?program a ?cls .
+    ?program ??1 ?entity .
+    ?entity ??2 ?value .
+}}
+"""
+
+# Значения одного свойства сущности по точному IRI
+ENTITY_PROPERTY_QUERY = """
+SELECT ?value WHERE {
+    ??1 ??2 ?value .
+}
+"""
+
+ALL_PATIENTS_QUERY = PREFIXES + f"""
+SELECT ?patient WHERE {{
+    ?cls a owl:Class .
+    {PATIENT_CLASS_FILTER}
+    ?patient a ?cls .
+}}
+"""
+
+ALL_PATIENTS_PROPERTY_QUERY = PREFIXES + f"""
+SELECT ?patient ?value WHERE {{
+    ?cls a owl:Class .
+    {PATIENT_CLASS_FILTER}
+    ?patient a ?cls .
+    ?patient ??1 ?value .
+}}
+"""
+
+ALL_INDIVIDUALS_QUERY = PREFIXES + """
+SELECT ?individual WHERE {
+    ?individual a owl:NamedIndividual .
+}
+"""
+
+ANNOTATIONS_QUERY = PREFIXES + """
+SELECT ?entity ?comment ?label WHERE {
+    ?entity a owl:NamedIndividual .
+    OPTIONAL { ?entity rdfs:comment ?comment . }
+    OPTIONAL { ?entity rdfs:label ?label . }
+}
+"""
+
+PROGRAM_PROPERTIES = (
+    'hasDuration', 'имеетДлительность', 'hasSessionCount', 'имеетКоличествоСеансов',
+    'includesMethod', 'включаетМетод', 'supervisedBy', 'курируется',
+    'suitableFor', 'подходитДля', 'hasTarget', 'имеетЦелевуюГруппу', 'имеетЦель',
+    'suitableMovementImpairment', 'подходитДляУровняДвижения',
+)
+METHOD_LINKS = ('includesMethod', 'включаетМетод')
+METHOD_PROPERTIES = ('hasEffectivenessScore', 'имеетЭффективность')
+PATIENT_PROPERTIES = ('hasMovementImpairment', 'hasTarget', 'hasCondition', 'hasSeverity', 'hasAgeGroup', 'hasPainLevel')
+SUITABLE_FOR = ('suitableFor', 'подходитДля')
+
+
+def _group(rows_by_property):
+    """{имя свойства: строки (сущность, значение)} -> {сущность: {имя свойства: [значения]}}"""
+    grouped = {}
+    for name, rows in rows_by_property.items():
+        for entity, value in rows:
+            grouped.setdefault(entity, {}).setdefault(name, []).append(value)
+    return grouped
+
+
+def _first(properties, *names):
+    for name in names:
+        values = properties.get(name)
+        if values:
+            return values[0]
+    return NOT_SPECIFIED
+
+
+def _first_lower(properties, name):
+    values = properties.get(name)
+    return str(values[0]).lower() if values else ''
+
+
+def _first_related(properties, *names):
+    for name in names:
+        values = properties.get(name)
+        if values:
+            return values
+    return []
+
+
+class SparqlRetriever:
+    """Подготовленные SPARQL-запросы к миру owlready2, в котором загружена онтология"""
+
+    def __init__(self, onto):
+        self.onto = onto
+        world = onto.world
+        self._all_programs = world.prepare_sparql(ALL_PROGRAMS_QUERY)
+        self._all_programs_property = world.prepare_sparql(ALL_PROGRAMS_PROPERTY_QUERY)
+        self._program_related_property = world.prepare_sparql(PROGRAM_RELATED_PROPERTY_QUERY)
+        self._entity_property = world.prepare_sparql(ENTITY_PROPERTY_QUERY)
+        self._all_patients = world.prepare_sparql(ALL_PATIENTS_QUERY)
+        self._all_patients_property = world.prepare_sparql(ALL_PATIENTS_PROPERTY_QUERY)
+        self._all_individuals = world.prepare_sparql(ALL_INDIVIDUALS_QUERY)
+        self._annotations = world.prepare_sparql(ANNOTATIONS_QUERY)
+        # Свойства ищутся по имени в любом пространстве имен, как при чтении атрибутов
+        self._properties = {}
+        for prop in world.properties():
+            self._properties.setdefault(prop.name, prop)
+        self._display_names = None
+
+    def _present(self, names):
+        return [(name, self._properties[name]) for name in names if name in self._properties]
+
+    def display_names(self):
+        """Отображаемые имена всех именованных сущностей (считаются один раз)"""
+        if self._display_names is None:
+            comments = {}
+            labels = {}
+            for entity, comment, label in self._annotations.execute():
+                if entity not in comments:
+                    comments[entity] = comment
+                    labels[entity] = label
+            self._display_names = {
+                entity: display_name_from(entity.name, comments[entity], labels[entity])
+                for entity in comments
+            }
+        return self._display_names
+
+    def _display(self, value):
+        display = self.display_names().get(value)
+        return display if display is not None else str(value)
+
+    def _related(self, properties, *names):
+        result = []
+        for name in names:
+            for item in properties.get(name, ()):
+                if item:
+                    result.append(self._display(item))
+        return result
+
+    def _method_record(self, method, properties):
+        effectiveness = _first(properties, *METHOD_PROPERTIES)
+        return MethodRecord(method.name, self._display(method), effectiveness)
+
+    def _program_record(self, program, properties, method_properties):
+        return ProgramRecord(
+            name=program.name,
+            display_name=self._display(program),
+            duration=_first(properties, 'hasDuration', 'имеетДлительность'),
+            session_count=_first(properties, 'hasSessionCount', 'имеетКоличествоСеансов'),
+            methods=self._related(properties, *METHOD_LINKS),
+            method_details=(
+                self._method_record(method, method_properties.get(method, {}))
+                for method in _first_related(properties, *METHOD_LINKS)
+                if method
+            ),
+            specialists=self._related(properties, 'supervisedBy', 'курируется'),
+            suitable_patients=self._related(properties, *SUITABLE_FOR),
+            suitable_patient_names=(
+                patient.name
+                for patient in _first_related(properties, *SUITABLE_FOR)
+                if hasattr(patient, 'name')
+            ),
+            target=self._related(properties, 'hasTarget', 'имеетЦелевуюГруппу'),
+            detail_target=self._related(properties, 'hasTarget', 'имеетЦель'),
+            movement_impairment=_first(properties, 'suitableMovementImpairment', 'подходитДляУровняДвижения'),
+        )
+
+    def programs(self):
+        """Записи всех программ онтологии"""
+        properties = _group({
+            name: self._all_programs_property.execute((prop,))
+            for name, prop in self._present(PROGRAM_PROPERTIES)
+        })
+        method_rows = {}
+        for _, link in self._present(METHOD_LINKS):
+            for name, prop in self._present(METHOD_PROPERTIES):
+                method_rows.setdefault(name, []).extend(self._program_related_property.execute((link, prop)))
+        method_properties = _group(method_rows)
+
+        programs = []
+        for (program,) in self._all_programs.execute():
+            try:
+                programs.append(self._program_record(program, properties.get(program, {}), method_properties))
+            except Exception as e:
+                logger.error("Ошибка при обработке программы %s: %s", program, e)
+        return programs
+
+    def _entity_properties(self, entity, names):
+        return {
+            name: [value for (value,) in self._entity_property.execute((entity, prop))]
+            for name, prop in self._present(names)
+        }
+
+    def program(self, iri):
+        """Запись одной программы по точному IRI (None, если сущности нет)"""
+        program = self.onto.world[iri]
+        if program is None:
+            return None
+        properties = self._entity_properties(program, PROGRAM_PROPERTIES)
+        method_properties = {
+            method: self._entity_properties(method, METHOD_PROPERTIES)
+            for method in _first_related(properties, *METHOD_LINKS)
+            if method
+        }
+        return self._program_record(program, properties, method_properties)
+
+    def patients(self, condition_mapping):
+        """Записи пациентов с совпавшими диагнозами и полями профиля"""
+        properties = _group({
+            name: self._all_patients_property.execute((prop,))
+            for name, prop in self._present(PATIENT_PROPERTIES)
+        })
+        patients = []
+        for (patient,) in self._all_patients.execute():
+            values = properties.get(patient, {})
+            patients.append(PatientRecord(
+                patient.name,
+                self._display(patient),
+                frozenset(
+                    diagnosis for diagnosis, possible_names in condition_mapping.items()
+                    if any(possible in patient.name for possible in possible_names)
+                ),
+                _first_lower(values, 'hasMovementImpairment'),
+                _first_lower(values, 'hasTarget'),
+                _first_lower(values, 'hasCondition'),
+                _first_lower(values, 'hasSeverity'),
+                _first_lower(values, 'hasAgeGroup'),
+                _first_lower(values, 'hasPainLevel'),
+                tuple(str(value).lower() for value in values.get('hasTarget', ())),
+            ))
+        return patients
+
+    def individuals(self):
+        """Пары (имя, отображаемое имя) всех именованных сущностей"""
+        return [
+            (individual.name, self._display(individual))
+            for (individual,) in self._all_individuals.execute()
+            if hasattr(individual, 'name')
+        ]
@@ -0,0 +1,325 @@
+"""Онтологии нескольких клиник в одном процессе.
+
+Каждая клиника описывается своим файлом онтологии в каталоге клиник
+(<каталог>/<клиника>.owx, .owl или .rdf). Онтология клиники загружается при
+первом запросе к ней в собственный OntologyManager. Загруженные клиники
+учитываются по занимаемой памяти: когда сумма превышает бюджет (или число
+клиник — max_loaded), вытесняются дольше всех не использовавшиеся (LRU);
+клиники без запросов дольше idle_ttl выгружаются при следующем обращении к
+реестру.
+
+Память клиники — объекты Python, оставшиеся после загрузки (по tracemalloc),
+плюс страницы SQLite-хранилища ее мира owlready2. tracemalloc замедляет все
+потоки процесса, поэтому замер выполняется вне обслуживания запросов:
+python -m tenants <каталог клиник> загружает каждую клинику и записывает
+размер рядом с файлом (<клиника>.memory.json, с хэшем онтологии). Для клиники
+без замера или с устаревшим замером (файл изменился) размер оценивается по
+размеру файла онтологии.
+
+Пример:
+    python -m tenants ontology/clinics
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from ontology_store import OntologyManager, source_path
+
+logger = logging.getLogger(__name__)
+
+CLINIC_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+ONTOLOGY_EXTENSIONS = ('.owx', '.owl', '.rdf')
+MEASUREMENT_SUFFIX = '.memory.json'
+# Оценка памяти клиники без замера: постоянная часть плюс байты на байт файла
+# онтологии (по замерам синтетических онтологий — от 7 до 30 на байт вместе с
+# постоянной частью); оценка с запасом, чтобы бюджет не превышался
+ESTIMATE_BASE_BYTES = 2 ** 20
+ESTIMATE_BYTES_PER_FILE_BYTE = 8
+
+
+def _store_bytes(onto):
+    """Размер SQLite-хранилища мира owlready2 (его страницы не видны tracemalloc)"""
+    if onto is None:
+        return 0
+    db = onto.world.graph.db
+    return db.execute('PRAGMA page_count').fetchone()[0] * db.execute('PRAGMA page_size').fetchone()[0]
+
+
+def _measurement_path(path):
+    return os.path.splitext(path)[0] + MEASUREMENT_SUFFIX
+
+
+def read_measurement(path, digest):
+    """Замер памяти клиники, записанный рядом с файлом онтологии (None, если
+    замера нет или он сделан для другого содержимого файла)"""
+    try:
+        with open(_measurement_path(path), encoding='utf-8') as f:
+            measurement = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(measurement, dict) or measurement.get('source_hash') != digest:
+        return None
+    size = measurement.get('bytes')
+    return size if isinstance(size, int) else None
+
+
+def estimate_size(path, onto):
+    """Оценка памяти клиники по размеру файла онтологии"""
+    file_size = os.path.getsize(source_path(path))
+    return ESTIMATE_BASE_BYTES + ESTIMATE_BYTES_PER_FILE_BYTE * file_size + _store_bytes(onto)
+
+
+def _load_measured(manager):
+    """Загрузить онтологию менеджера; вернуть память, оставшуюся занятой после
+    загрузки (None, если загрузка не удалась)"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        snapshot = manager.load_if_missing()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    if snapshot is None:
+        return None
+    return max(0, allocated) + _store_bytes(snapshot.onto)
+
+
+def measure(path, build_system):
+    """Загрузить онтологию клиники с замером памяти и записать замер рядом с файлом"""
+    manager = OntologyManager(path, build_system)
+    try:
+        size = _load_measured(manager)
+        if size is None:
+            raise ClinicUnavailable(os.path.basename(path), manager.last_error)
+        measurement = {
+            'source': os.path.basename(source_path(path)),
+            'source_hash': manager.current.digest,
+            'bytes': size,
+            'measured_at': time.time(),
+        }
+    finally:
+        manager.close()
+    target = _measurement_path(path)
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(measurement, f, ensure_ascii=False)
+    os.replace(tmp_path, target)
+    return size
+
+
+class UnknownClinic(LookupError):
+    """Для клиники нет файла онтологии"""
+
+
+class ClinicUnavailable(RuntimeError):
+    """Онтологию клиники не удалось загрузить; следующий запрос повторит загрузку"""
+
+    def __init__(self, clinic, error):
+        super().__init__(f'{clinic}: {error}')
+        self.clinic = clinic
+        self.error = error
+
+
+class _Tenant:
+    __slots__ = ('manager', 'size', 'last_used')
+
+    def __init__(self, manager, size):
+        self.manager = manager
+        self.size = size
+        self.last_used = time.monotonic()
+
+
+class TenantRegistry:
+    """Загруженные онтологии клиник с бюджетом памяти и LRU-вытеснением"""
+
+    def __init__(self, directory, build_system, memory_budget, idle_ttl=0, watch_interval=None, max_loaded=0):
+        self.directory = directory
+        self.build_system = build_system
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.watch_interval = watch_interval
+        self.max_loaded = max_loaded
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        # Загрузки выполняются по одной: клиника не загружается дважды, и пики
+        # памяти одновременных загрузок не складываются
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def path_for(self, clinic):
+        """Файл онтологии клиники"""
+        if not CLINIC_PATTERN.match(clinic):
+            raise UnknownClinic(clinic)
+        for extension in ONTOLOGY_EXTENSIONS:
+            path = os.path.join(self.directory, clinic + extension)
+            if os.path.isfile(path):
+                return path
+        raise UnknownClinic(clinic)
+
+    def get(self, clinic):
+        """Менеджер онтологии клиники; при первом обращении онтология загружается.
+        UnknownClinic — нет файла клиники, ClinicUnavailable — файл не загрузился"""
+        manager = self._touch(clinic)
+        if manager is None:
+            path = self.path_for(clinic)
+            with self._load_lock:
+                manager = self._touch(clinic)
+                if manager is None:
+                    manager = self._load(clinic, path)
+        self._release(self._expired(keep=clinic))
+        return manager
+
+    def _touch(self, clinic):
+        with self._lock:
+            tenant = self._tenants.get(clinic)
+            if tenant is None:
+                return None
+            tenant.last_used = time.monotonic()
+            self._tenants.move_to_end(clinic)
+            return tenant.manager
+
+    def _load(self, clinic, path):
+        started = time.perf_counter()
+        manager = OntologyManager(path, self.build_system)
+        snapshot = manager.load_if_missing()
+        if snapshot is None:
+            # Неудачная загрузка не регистрируется: следующий запрос к клинике повторит ее
+            manager.close()
+            raise ClinicUnavailable(clinic, manager.last_error)
+        size = read_measurement(path, snapshot.digest)
+        if size is None:
+            size = estimate_size(path, snapshot.onto)
+            logger.warning("Для клиники %s нет замера памяти, оценка по размеру файла "
+                           "(замер: python -m tenants %s)", clinic, self.directory)
+
+        with self._lock:
+            self._tenants[clinic] = _Tenant(manager, size)
+            self.loads += 1
+            evicted = self._over_budget(keep=clinic)
+        logger.info("Клиника %s загружена за %.2f с (версия %s, ~%.1f МБ)",
+                    clinic, time.perf_counter() - started, manager.current.version, size / 2 ** 20)
+        self._release(evicted)
+        if self.watch_interval:
+            manager.watch(self.watch_interval)
+        return manager
+
+    def _over_budget(self, keep):
+        """Вытеснить давно не использовавшиеся клиники, пока сумма превышает бюджет
+        или число клиник превышает max_loaded"""
+        evicted = []
+        total = sum(tenant.size for tenant in self._tenants.values())
+        for clinic in list(self._tenants):
+            if total <= self.memory_budget and not (self.max_loaded and len(self._tenants) > self.max_loaded):
+                break
+            if clinic == keep:
+                continue
+            tenant = self._tenants.pop(clinic)
+            total -= tenant.size
+            evicted.append((clinic, tenant))
+        return evicted
+
+    def _expired(self, keep):
+        """Выгрузить клиники, к которым не обращались дольше idle_ttl"""
+        if not self.idle_ttl:
+            return []
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = []
+        with self._lock:
+            for clinic, tenant in list(self._tenants.items()):
+                if tenant.last_used >= deadline:
+                    break
+                if clinic != keep:
+                    evicted.append((clinic, self._tenants.pop(clinic)))
+        return evicted
+
+    def _release(self, evicted):
+        for clinic, tenant in evicted:
+            tenant.manager.close()
+            with self._lock:
+                self.evictions += 1
+            logger.info("Клиника %s выгружена (~%.1f МБ)", clinic, tenant.size / 2 ** 20)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': len(self._tenants),
+                'memory_bytes': sum(tenant.size for tenant in self._tenants.values()),
+                'memory_budget_bytes': self.memory_budget,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+    def collect_metrics(self):
+        stats = self.stats()
+        return [
+            '# HELP rehab_tenants_loaded Загруженные онтологии клиник',
+            '# TYPE rehab_tenants_loaded gauge',
+            f'rehab_tenants_loaded {stats["loaded"]}',
+            '# HELP rehab_tenants_memory_bytes Оценка памяти загруженных клиник',
+            '# TYPE rehab_tenants_memory_bytes gauge',
+            f'rehab_tenants_memory_bytes {stats["memory_bytes"]}',
+            '# HELP rehab_tenants_memory_budget_bytes Бюджет памяти клиник',
+            '# TYPE rehab_tenants_memory_budget_bytes gauge',
+            f'rehab_tenants_memory_budget_bytes {stats["memory_budget_bytes"]}',
+            '# HELP rehab_tenant_loads_total Загрузки онтологий клиник',
+            '# TYPE rehab_tenant_loads_total counter',
+            f'rehab_tenant_loads_total {stats["loads"]}',
+            '# HELP rehab_tenant_evictions_total Выгрузки онтологий клиник',
+            '# TYPE rehab_tenant_evictions_total counter',
+            f'rehab_tenant_evictions_total {stats["evictions"]}',
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='каталог онтологий клиник')
+    parser.add_argument('clinics', nargs='*', help='клиники (по умолчанию все)')
+    args = parser.parse_args()
+
+    from app import RehabilitationSystem
+    registry = TenantRegistry(args.directory, RehabilitationSystem, memory_budget=0)
+    clinics = args.clinics or sorted({
+        name[:-len(extension)] for name in os.listdir(args.directory)
+        for extension in ONTOLOGY_EXTENSIONS if name.endswith(extension)
+    })
+    # Первая загрузка в процессе оставляет занятыми импорты и кэши owlready2;
+    # они не относятся к клинике, поэтому одна загрузка выполняется без замера
+    for clinic in clinics:
+        try:
+            manager = OntologyManager(registry.path_for(clinic), RehabilitationSystem)
+        except UnknownClinic:
+            continue
+        loaded = manager.load_if_missing() is not None
+        manager.close()
+        if loaded:
+            break
+
+    failed = False
+    for clinic in clinics:
+        try:
+            size = measure(registry.path_for(clinic), RehabilitationSystem)
+        except UnknownClinic:
+            print(f'{clinic}: нет файла онтологии')
+            failed = True
+            continue
+        except ClinicUnavailable as e:
+            print(f'{clinic}: ошибка загрузки: {e.error}')
+            failed = True
+            continue
+        print(f'{clinic}: {size / 2 ** 20:.1f} МБ')
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()